@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""This module contains the synchronised acquisition of cameras.
+
+Cameras logged at a scan point are prepared together, then started at once
+by threads released by a single event, so their exposures overlap and their
+frames line up in time. They are waited for together with the logs of the
+other devices. A camera is a device model with |prepare_async|,
+|start_acquisition| and |finish_async|, see |model.LimaCCDsModel|.
+
+"""
+
+import sys
+import threading
+
+import asyncdevice
+
+
+def is_camera(device):
+    """Return whether |device| is started by |start|."""
+    return hasattr(device, "start_acquisition")
+
+
+def start(cameras):
+    """Start the prepared acquisitions of |cameras| at once. Return list of
+    their start timestamps.
+
+    Each camera is started from its own thread, as startAcq blocks until the
+    camera has started. The threads wait for one event, so the skew between
+    cameras is the wake up time of a thread rather than a tango round trip.
+
+    Args:
+        cameras (list of model.LimaCCDsModel): cameras to be started.
+
+    """
+    if len(cameras) == 1:
+        return [cameras[0].start_acquisition()]
+    timestamps = [None] * len(cameras)
+    errors = []
+    go = threading.Event()
+
+    def run(idx):
+        """Start camera |idx| when released."""
+        go.wait()
+        try:
+            timestamps[idx] = cameras[idx].start_acquisition()
+        except Exception:
+            errors.append(sys.exc_info())
+
+    threads = [threading.Thread(target=run, args=(idx,),
+                                name="Start %s" % camera.device_name)
+               for idx, camera in enumerate(cameras)]
+    for thread in threads:
+        thread.start()
+    go.set()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return timestamps
+
+
+def log(devices, out):
+    """Log |devices| at a scan point. Return list of results of their logs.
+
+    Cameras are prepared together and started by |start|. Then their frames
+    are logged concurrently with the logs of the other devices, so a point
+    takes one exposure however many cameras are logged.
+
+    Args:
+        devices (list of model.DeviceModel): devices to be logged.
+        out (file object): where log is written.
+
+    """
+    cameras = [device for device in devices if is_camera(device)]
+    if cameras:
+        asyncdevice.gather([camera.prepare_async() for camera in cameras])
+        start(cameras)
+    return asyncdevice.gather([device.finish_async(out) if is_camera(device)
+                               else device.log_async(out)
+                               for device in devices])
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# pylint: disable=too-many-locals
+"""This module is the post-scan analysis of camera frames.
+
+All frames of a scan folder are analysed in parallel worker processes. Frames
+are read from the frame containers of the scan, see |container|, or from raw
+files of older scans, which are memory-mapped.
+For each camera and scan point, the frames are reduced to:
+
+    - sum: total intensity.
+    - roi_sum: intensity inside the region of interest, after background
+      subtraction.
+    - centroid_x, centroid_y: intensity-weighted centre of the region of
+      interest, after background subtraction.
+    - max: largest pixel value in the region of interest.
+
+The results are written as a CSV table aligned with the scan points, and the
+ROI sum of each camera is fitted with a Gaussian peak against the scanned
+attribute.
+
+Usage:
+
+    ./analysis.py FOLDER [--roi X0 Y0 X1 Y1] [--background FILE]
+
+"""
+
+import argparse
+import csv
+import math
+import multiprocessing
+import os
+import re
+
+import numpy as np
+
+import container
+import frame
+import journal
+
+_IMAGE_LINE = re.compile(r"^LimaCCDs::(.+)::Image = (\d+) (\d+) (\w+)$")
+_FILE_LINE = re.compile(r"^LimaCCDs::(.+)::ImageFile\d+ = (\S+)$")
+_FRAME_LINE = re.compile(r"^LimaCCDs::(.+)::Frame\d+ = (\S+)#(\d+)$")
+# Frames analysed per worker task.
+CHUNK_SIZE = 64
+COLUMNS = ["sum", "roi_sum", "centroid_x", "centroid_y", "max"]
+
+
+def load_frames(folder_path):
+    """Return scan definition, point records and frames of the scan in
+    |folder_path|.
+
+    Frames are a list of (point index, device, path, number, width, height,
+    image type), in log order. |number| is the frame number in the container
+    at |path|, or None for a raw file.
+
+    Args:
+        folder_path (str): scan folder, ends with "/".
+
+    """
+    header, points = journal.load(folder_path)
+    with open(folder_path + header["scan_id"] + ".log") as log_file:
+        log = log_file.read()
+    frames = []
+    start = 0
+    for idx, point in enumerate(points):
+        images = {}
+        for line in log[start:point["offset"]].splitlines():
+            match = _IMAGE_LINE.match(line)
+            if match:
+                images[match.group(1)] = (int(match.group(2)),
+                                          int(match.group(3)),
+                                          match.group(4))
+                continue
+            match = _FRAME_LINE.match(line)
+            if match and match.group(1) in images:
+                device = match.group(1)
+                frames.append((idx, device, folder_path + match.group(2),
+                               int(match.group(3))) + images[device])
+                continue
+            match = _FILE_LINE.match(line)
+            if match and match.group(1) in images:
+                device = match.group(1)
+                frames.append((idx, device, folder_path + match.group(2),
+                               None) + images[device])
+        start = point["offset"]
+    return header["definition"], points, frames
+
+
+def _analyse_chunk(task):
+    """Return reductions of a chunk of frames. Run in worker processes.
+
+    Args:
+        task (tuple): (frames, roi, background path). See |load_frames| and
+                |analyse|.
+
+    """
+    frames, roi, background_path = task
+    background = None
+    # Container path -> reader, shared by the frames of the chunk.
+    readers = {}
+    results = []
+    for _, _, path, number, width, height, image_type in frames:
+        if number is None:
+            image = frame.open_raw(path, width, height, image_type)
+        else:
+            if path not in readers:
+                readers[path] = container.FrameReader(path)
+            image = readers[path].read(number)
+        x_0, y_0, x_1, y_1 = roi or (0, 0, width, height)
+        region = image[y_0:y_1, x_0:x_1].astype(np.float32)
+        if background_path:
+            if background is None:
+                background = frame.open_raw(background_path, width, height,
+                                            image_type)
+            region -= background[y_0:y_1, x_0:x_1]
+        weights = np.clip(region, 0, None)
+        total = float(weights.sum())
+        if total:
+            centroid_x = float(weights.sum(axis=0).dot(
+                    np.arange(x_0, x_0 + region.shape[1]))) / total
+            centroid_y = float(weights.sum(axis=1).dot(
+                    np.arange(y_0, y_0 + region.shape[0]))) / total
+        else:
+            centroid_x = centroid_y = float("nan")
+        results.append((float(image.sum(dtype=np.float64)),
+                        float(region.sum(dtype=np.float64)), centroid_x,
+                        centroid_y, float(region.max())))
+    for reader in readers.values():
+        reader.close()
+    return results
+
+
+def fit_peak(values, heights):
+    """Return (centre, fwhm, amplitude, baseline) of a Gaussian peak fitted to
+    |heights| at |values|, or None if no peak is found.
+
+    The baseline is the smallest height. The logarithm of the heights above
+    the baseline is fitted with a parabola, weighted by the heights, using
+    the points above a tenth of the peak.
+
+    Args:
+        values (list of float): values of the scanned attribute.
+        heights (list of float): eg. ROI sums at |values|.
+
+    """
+    values = np.asarray(values, dtype=np.float64)
+    heights = np.asarray(heights, dtype=np.float64)
+    valid = np.isfinite(heights)
+    values, heights = values[valid], heights[valid]
+    if len(values) < 3:
+        return None
+    baseline = heights.min()
+    signal = heights - baseline
+    used = signal > 0.1 * signal.max()
+    if used.sum() < 3:
+        return None
+    coeffs = np.polyfit(values[used], np.log(signal[used]), 2,
+                        w=np.sqrt(signal[used]))
+    if coeffs[0] >= 0:
+        return None
+    sigma = math.sqrt(-1 / (2 * coeffs[0]))
+    centre = coeffs[1] * sigma ** 2
+    amplitude = math.exp(coeffs[2] + centre ** 2 / (2 * sigma ** 2))
+    return centre, 2 * math.sqrt(2 * math.log(2)) * sigma, amplitude, baseline
+
+
+def analyse(folder_path, roi=None, background_path=None, processes=None):
+    """Analyse all frames of the scan in |folder_path|. Return (columns,
+    rows) of the table aligned with the scan points.
+
+    Args:
+        folder_path (str): scan folder.
+        roi (tuple): (x0, y0, x1, y1) region of interest in pixels, or None
+                for whole frames.
+        background_path (str): raw file subtracted from the frames, eg. a
+                dark frame, or None.
+        processes (int): number of worker processes. Default is the number
+                of cores.
+
+    """
+    folder_path = os.path.join(folder_path, "")
+    definition, points, frames = load_frames(folder_path)
+    tasks = [(frames[idx:idx + CHUNK_SIZE], roi, background_path)
+             for idx in range(0, len(frames), CHUNK_SIZE)]
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = [result for chunk in pool.map(_analyse_chunk, tasks)
+                   for result in chunk]
+    finally:
+        pool.close()
+        pool.join()
+
+    # Reduce the frames of each camera and point.
+    devices = sorted(set(frame_info[1] for frame_info in frames))
+    table = {}
+    for frame_info, result in zip(frames, results):
+        key = (frame_info[0], frame_info[1])
+        if key not in table:
+            table[key] = list(result)
+            continue
+        total, roi_sum, centroid_x, centroid_y, maximum = table[key]
+        weight, new_weight = max(roi_sum, 0), max(result[1], 0)
+        if weight and new_weight:
+            centroid_x = (centroid_x * weight + result[2] * new_weight) / \
+                    (weight + new_weight)
+            centroid_y = (centroid_y * weight + result[3] * new_weight) / \
+                    (weight + new_weight)
+        elif new_weight:
+            centroid_x, centroid_y = result[2:4]
+        table[key] = [total + result[0], roi_sum + result[1], centroid_x,
+                      centroid_y, max(maximum, result[4])]
+    columns = ["point", definition["attr"]] + \
+            ["%s:%s" % (device, column) for device in devices
+             for column in COLUMNS]
+    rows = []
+    for idx, point in enumerate(points):
+        row = [point["point"], point["value"]]
+        for device in devices:
+            row += table.get((idx, device), [float("nan")] * len(COLUMNS))
+        rows.append(row)
+    return columns, rows
+
+
+def main():
+    """Analyse a scan folder and write the table next to its log."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("folder", help="scan folder")
+    parser.add_argument("--roi", type=int, nargs=4,
+                        metavar=("X0", "Y0", "X1", "Y1"),
+                        help="region of interest in pixels")
+    parser.add_argument("--background", help="raw file of the background")
+    parser.add_argument("--processes", type=int,
+                        help="number of worker processes")
+    args = parser.parse_args()
+
+    folder_path = os.path.join(args.folder, "")
+    scan_id = journal.load(folder_path)[0]["scan_id"]
+    columns, rows = analyse(folder_path, args.roi, args.background,
+                            args.processes)
+    out_path = folder_path + scan_id + ".analysis.csv"
+    with open(out_path, "wb") as out_file:
+        writer = csv.writer(out_file)
+        writer.writerow(columns)
+        writer.writerows(rows)
+    print "Wrote %d points to %s." % (len(rows), out_path)
+    for col, column in enumerate(columns):
+        if column.endswith(":roi_sum"):
+            peak = fit_peak([row[1] for row in rows],
+                            [row[col] for row in rows])
+            if peak:
+                print "%s peak: centre %g, FWHM %g, amplitude %g, " \
+                      "baseline %g." % ((column.rsplit(":", 1)[0],) + peak)
+            else:
+                print "%s: no peak found." % column.rsplit(":", 1)[0]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# pylint: disable=too-few-public-methods
+"""This module contains the asynchronous device layer of Control System.
+
+Device I/O is written as generator coroutines which yield tango requests in
+flight and receive their replies, eg.
+
+    def log_async(self, out):
+        nb_frames = (yield asyncdevice.read(self.tango_device,
+                                            "acq_nb_frames")).value
+        yield asyncdevice.command(self.tango_device, "prepareAcq")
+        ...
+        raise asyncdevice.Return(quantities)
+
+Requests are sent with the asynchronous tango API, so |gather| keeps the I/O
+of many devices in flight from a single thread.
+
+A coroutine may yield:
+    - a request returned by |read|, |write| or |command|, and receives its
+      reply;
+    - |Sleep|, and receives None after the delay;
+    - a call returned by |call|, and receives its result, eg. a blocking
+      Sardana macro run in a worker thread;
+    - another coroutine, and receives its result, eg. to run the phases of
+      a log one after another;
+    - a list of the above, and receives the list of their results;
+    - None, to let other coroutines run.
+
+"""
+
+import sys
+import threading
+import time
+import types
+
+import PyTango
+
+
+class Return(Exception):
+    """Raised by a coroutine to return |value|, as generators cannot return
+    values in Python 2."""
+    def __init__(self, value=None):
+        Exception.__init__(self)
+        self.value = value
+
+
+class Request(object):
+    """Tango request in flight.
+
+    Args:
+        reply (callable): reply method of the device proxy, eg.
+                |read_attribute_reply|.
+        request_id (int): id returned by the asynchronous call.
+
+    """
+    def __init__(self, reply, request_id):
+        self._reply = reply
+        self._id = request_id
+
+    def poll(self, timeout):
+        """Return (True, reply) if the reply arrives within |timeout|
+        seconds, otherwise (False, None)."""
+        try:
+            if timeout:
+                return True, self._reply(self._id,
+                                         max(1, int(timeout * 1000)))
+            return True, self._reply(self._id)
+        except PyTango.AsynReplyNotArrived:
+            return False, None
+
+
+class Sleep(object):
+    """Delay of |seconds| which does not block other coroutines."""
+    def __init__(self, seconds):
+        self._deadline = time.time() + seconds
+
+    def poll(self, timeout):
+        """Return (True, None) if the delay elapses within |timeout| seconds,
+        otherwise (False, None)."""
+        remaining = self._deadline - time.time()
+        if 0 < remaining and timeout:
+            time.sleep(min(remaining, timeout))
+            remaining = self._deadline - time.time()
+        return remaining <= 0, None
+
+
+class Call(object):
+    """Blocking call running in a worker thread.
+
+    Args:
+        function (callable): called with |args| in the worker thread.
+
+    """
+    def __init__(self, function, *args):
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+        thread = threading.Thread(target=self._run, args=(function, args),
+                                  name="Call %s" % function.__name__)
+        thread.daemon = True
+        thread.start()
+
+    def _run(self, function, args):
+        """Run |function| and keep its result or exception."""
+        try:
+            self._result = function(*args)
+        except Exception:
+            self._exc_info = sys.exc_info()
+        self._done.set()
+
+    def poll(self, timeout):
+        """Return (True, result) if the call returns within |timeout|
+        seconds, otherwise (False, None). Its exception is raised."""
+        if not self._done.wait(timeout):
+            return False, None
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return True, self._result
+
+
+class _Gather(object):
+    """List of requests and delays waited for together."""
+    def __init__(self, awaitables):
+        self._awaitables = [_as_awaitable(awaitable)
+                            for awaitable in awaitables]
+        self._results = [None] * len(self._awaitables)
+        self._pending = range(len(self._awaitables))
+
+    def poll(self, timeout):
+        """Return (True, list of results) if all are done within |timeout|
+        seconds, otherwise (False, None)."""
+        for idx in list(self._pending):
+            done, result = self._awaitables[idx].poll(0)
+            if done:
+                self._results[idx] = result
+                self._pending.remove(idx)
+        if self._pending and timeout:
+            idx = self._pending[0]
+            done, result = self._awaitables[idx].poll(timeout)
+            if done:
+                self._results[idx] = result
+                self._pending.remove(idx)
+        return not self._pending, self._results if not self._pending else None
+
+
+class _Coroutine(object):
+    """Coroutine awaited by another one, run step by step by |poll|."""
+    def __init__(self, coroutine):
+        self._coroutine = coroutine
+        self._awaited = None
+
+    def _send(self, value=None, exc_info=None):
+        """Resume the coroutine with |value| or |exc_info|. Return (True,
+        result) if it returns, otherwise (False, None)."""
+        try:
+            if exc_info:
+                awaited = self._coroutine.throw(*exc_info)
+            else:
+                awaited = self._coroutine.send(value)
+        except StopIteration:
+            return True, None
+        except Return as ret:
+            return True, ret.value
+        self._awaited = _as_awaitable(awaited)
+        return False, None
+
+    def poll(self, timeout):
+        """Return (True, result) if the coroutine returns within |timeout|
+        seconds, otherwise (False, None). Its exceptions are raised."""
+        if self._awaited is None:
+            done, result = self._send()
+            if done:
+                return True, result
+        while True:
+            exc_info = None
+            try:
+                ready, value = self._awaited.poll(timeout)
+            except Exception:
+                ready, value, exc_info = True, None, sys.exc_info()
+            if not ready:
+                return False, None
+            # Keep running while what it waits for is already done.
+            timeout = 0
+            done, result = self._send(value, exc_info)
+            if done:
+                return True, result
+
+
+def _as_awaitable(value):
+    """Return what a coroutine yielded as an object with |poll|."""
+    if value is None:
+        return Sleep(0)
+    if isinstance(value, list):
+        return _Gather(value)
+    if isinstance(value, types.GeneratorType):
+        return _Coroutine(value)
+    return value
+
+
+def read(tango_device, attr):
+    """Return request reading |attr| of |tango_device|. Its reply is the
+    DeviceAttribute, as returned by |read_attribute|."""
+    return Request(tango_device.read_attribute_reply,
+                   tango_device.read_attribute_asynch(attr))
+
+
+def write(tango_device, attr, val):
+    """Return request writing |val| to |attr| of |tango_device|."""
+    return Request(tango_device.write_attribute_reply,
+                   tango_device.write_attribute_asynch(attr, val))
+
+
+def command(tango_device, name, *argin):
+    """Return request running command |name| of |tango_device|. Its reply is
+    the command result."""
+    return Request(tango_device.command_inout_reply,
+                   tango_device.command_inout_asynch(name, *argin))
+
+
+def call(function, *args):
+    """Return |Call| running blocking |function| with |args| in a worker
+    thread, so other coroutines go on meanwhile."""
+    return Call(function, *args)
+
+
+def gather(coroutines, interval=0.01, return_exceptions=False):
+    """Run |coroutines| concurrently in this thread until all are done.
+    Return list of their results.
+
+    If a coroutine raises, the others still run to completion and the first
+    exception is raised afterwards.
+
+    Args:
+        coroutines (list of generator): coroutines to be run.
+        interval (float): longest time in seconds spent waiting for one
+                coroutine while others may be ready.
+        return_exceptions (bool): whether exceptions are returned as results
+                of the failed coroutines instead of raised.
+
+    """
+    results = [None] * len(coroutines)
+    waiting = {}
+    errors = []
+
+    def step(idx, value=None, exc_info=None):
+        """Resume coroutine |idx| with |value| or |exc_info|."""
+        try:
+            if exc_info:
+                awaited = coroutines[idx].throw(*exc_info)
+            else:
+                awaited = coroutines[idx].send(value)
+            waiting[idx] = _as_awaitable(awaited)
+            return
+        except StopIteration:
+            pass
+        except Return as ret:
+            results[idx] = ret.value
+        except Exception:
+            if return_exceptions:
+                results[idx] = sys.exc_info()[1]
+            else:
+                errors.append(sys.exc_info())
+        waiting.pop(idx, None)
+
+    def resume(idx, timeout):
+        """Resume coroutine |idx| if what it waits for is done. Return True
+        if resumed."""
+        try:
+            done, value = waiting[idx].poll(timeout)
+        except Exception:
+            step(idx, exc_info=sys.exc_info())
+            return True
+        if done:
+            step(idx, value)
+        return done
+
+    for idx in range(len(coroutines)):
+        step(idx)
+    while waiting:
+        resumed = [resume(idx, 0) for idx in sorted(waiting)]
+        if waiting and not any(resumed):
+            # Block on one coroutine for a while instead of busy polling.
+            resume(min(waiting), interval)
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return results
+
+
+def run(coroutine):
+    """Run |coroutine| until it is done and return its result."""
+    return gather([coroutine])[0]
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+"""This module contains the frame container of scans.
+
+All frames of a camera in a scan are stored in one data file, each frame as a
+compressed chunk, next to a fixed-size index file:
+
+    <scan_id>_<device>.frames       compressed chunks, appended in order.
+    <scan_id>_<device>.frames.idx   8-byte magic, then one record per frame:
+                                    offset (Q), length (I), width (I),
+                                    height (I), numpy dtype (4s).
+
+Chunks are byte-shuffled, so the high bytes of all pixels are next to each
+other, and compressed with fast zlib. Frame |n| is read in O(1) from the
+record at 8 + 24 * |n| of the index. A chunk is written before its record,
+so a crash never leaves a record pointing past the data, and a torn tail is
+dropped when the container is reopened.
+
+Scans append frames through |BackgroundFrameWriter|, so the compression and
+writing of a frame overlap the next scan point.
+
+"""
+
+import os
+import struct
+import threading
+import zlib
+import Queue
+
+import numpy as np
+
+MAGIC = "CSFIDX01"
+_RECORD = struct.Struct("<QIII4s")
+# Fast compression, most of the gain comes from the byte shuffle.
+LEVEL = 1
+
+
+def frame_path(folder_path, scan_id, device):
+    """Return path of the frame container of |device| in a scan folder."""
+    return "%s%s_%s.frames" % (folder_path, scan_id, device.replace("/", "_"))
+
+
+def _encode(image):
+    """Return |image| as a compressed chunk."""
+    data = np.ascontiguousarray(image).view(np.uint8)
+    shuffled = data.reshape(-1, image.dtype.itemsize).T.tostring()
+    return zlib.compress(shuffled, LEVEL)
+
+
+def _decode(chunk, width, height, dtype):
+    """Return image of a compressed chunk."""
+    dtype = np.dtype(dtype)
+    shuffled = np.frombuffer(zlib.decompress(chunk), dtype=np.uint8)
+    data = shuffled.reshape(dtype.itemsize, -1).T.copy()
+    return data.view(dtype).reshape((height, width))
+
+
+class FrameWriter(object):
+    """Appender of frames to a container.
+
+    Args:
+        path (str): path of the container data file, see |frame_path|.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        is_new = not os.path.exists(path + ".idx")
+        self._data = open(path, "wb" if is_new else "r+b")
+        self._index = open(path + ".idx", "wb" if is_new else "r+b")
+        if is_new:
+            self._index.write(MAGIC)
+            self._count = 0
+            self._offset = 0
+        else:
+            self._repair()
+
+    def __len__(self):
+        return self._count
+
+    def _repair(self):
+        """Drop a torn tail left by a crash while appending."""
+        if self._index.read(len(MAGIC)) != MAGIC:
+            raise IOError("Not a frame container: %s." % self.path)
+        self._index.seek(0, os.SEEK_END)
+        self._count = (self._index.tell() - len(MAGIC)) // _RECORD.size
+        self._data.seek(0, os.SEEK_END)
+        data_size = self._data.tell()
+        self._offset = 0
+        while self._count:
+            self._index.seek(len(MAGIC) + (self._count - 1) * _RECORD.size)
+            offset, length = _RECORD.unpack(
+                    self._index.read(_RECORD.size))[:2]
+            if offset + length <= data_size:
+                self._offset = offset + length
+                break
+            self._count -= 1
+        self._index.truncate(len(MAGIC) + self._count * _RECORD.size)
+        self._data.truncate(self._offset)
+        self._index.seek(0, os.SEEK_END)
+        self._data.seek(0, os.SEEK_END)
+
+    def append(self, image):
+        """Append 2-D numpy array |image|. Return its frame number."""
+        chunk = _encode(image)
+        self._data.write(chunk)
+        self._data.flush()
+        self._index.write(_RECORD.pack(self._offset, len(chunk),
+                                       image.shape[1], image.shape[0],
+                                       image.dtype.str))
+        self._index.flush()
+        self._offset += len(chunk)
+        self._count += 1
+        return self._count - 1
+
+    def close(self):
+        """Close the container."""
+        self._data.close()
+        self._index.close()
+
+
+class BackgroundFrameWriter(object):
+    """Appender of frames backed by a dedicated thread, as |logwriter| does
+    for logs. Frames are put into a bounded queue, then compressed and
+    appended by the thread, so appending costs the caller a queue put.
+
+    Args:
+        path (str): path of the container data file, see |frame_path|.
+        max_frames (int): size of the frame queue. |append| blocks when the
+                queue is full.
+
+    """
+    def __init__(self, path, max_frames=16):
+        self.path = path
+        self._writer = FrameWriter(path)
+        # Frames are numbered in order, so numbers are known when queued.
+        self._count = len(self._writer)
+        self._queue = Queue.Queue(max_frames)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="FrameWriter")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, image):
+        """Queue 2-D numpy array |image|, which must not be modified
+        afterwards. Return its frame number."""
+        if self._error:
+            raise IOError("Frame writer failed: %s" % self._error)
+        self._queue.put(image)
+        self._count += 1
+        return self._count - 1
+
+    def close(self):
+        """Append all queued frames and close the container."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self._error:
+            raise IOError("Frame writer failed: %s" % self._error)
+
+    def _run(self):
+        """Append queued frames until closed."""
+        try:
+            image = self._queue.get()
+            while image is not None:
+                self._writer.append(image)
+                image = self._queue.get()
+        except Exception as err: # pylint: disable=broad-except
+            self._error = err
+            # Keep consuming so that |append| never blocks on a full queue.
+            while self._queue.get() is not None:
+                pass
+        finally:
+            self._writer.close()
+
+
+class FrameReader(object):
+    """Random-access reader of a container. Frames appended while reading
+    are visible.
+
+    Args:
+        path (str): path of the container data file, see |frame_path|.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self._data = open(path, "rb")
+        self._index = open(path + ".idx", "rb")
+        if self._index.read(len(MAGIC)) != MAGIC:
+            raise IOError("Not a frame container: %s." % path)
+
+    def __len__(self):
+        return (os.fstat(self._index.fileno()).st_size - len(MAGIC)) // \
+                _RECORD.size
+
+    def __getitem__(self, number):
+        return self.read(number)
+
+    def read(self, number):
+        """Return frame |number| as 2-D numpy array."""
+        if not 0 <= number < len(self):
+            raise IndexError("No frame %d in %s." % (number, self.path))
+        self._index.seek(len(MAGIC) + number * _RECORD.size)
+        offset, length, width, height, dtype = _RECORD.unpack(
+                self._index.read(_RECORD.size))
+        self._data.seek(offset)
+        return _decode(self._data.read(length), width, height,
+                       dtype.rstrip("\0"))
+
+    def close(self):
+        """Close the container."""
+        self._data.close()
+        self._index.close()
@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+# pylint: disable=bad-continuation, broad-except, too-few-public-methods, too-many-instance-attributes
+"""This module is the scan engine daemon of Control System.
+
+The daemon owns the tango connection, the device models and the scan queue,
+and serves clients over a local Unix socket. Several GUIs, scripts and
+monitors can attach at the same time, and a running scan goes on when a
+client dies. Clients use |remote.DaemonClient|, and the GUI attaches with
+"gui.py --daemon".
+
+Protocol: each request is a JSON object on one line, eg.
+
+    {"command": "add_device", "name": "motor/dummy_mot_ctrl/1"}
+
+and is answered by {"ok": true, "result": ...} or {"ok": false, "error": ...}.
+After {"command": "subscribe"} the connection only receives events, one JSON
+object per line: {"event": "point", "tag": ..., "record": {...}},
+{"event": "error", "tag": ..., "message": ...}, {"event": "done", "tag": ...}
+and {"event": "finish"}. The tag is the one given by the client which queued
+the scan, so a client picks the events of its own scans; errors which do not
+belong to a running scan have no tag. "done" is sent when a scan is over,
+whether it succeeded, failed or was stopped, and "finish" when the queue is
+empty.
+
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import Queue
+import SocketServer
+
+import gui
+import logwriter
+import scan
+from framecache import FrameCache
+from remote import SOCKET_PATH, DaemonClient, dumps, encode_frame
+
+
+class ScanDaemon(object):
+    """Scan engine shared by all clients.
+
+    Args:
+        log_path (str): where log folders are placed.
+        frame_cache_bytes (int): memory budget of recent frames.
+
+    Attributes:
+        tango (gui.Tango): tango control system interface.
+        devices (dict): device name -> added |model.DeviceModel|.
+        scan_queue (scan.ScanQueue): scans to be run back to back.
+        frame_cache (framecache.FrameCache): recent frames logged by cameras.
+
+    """
+    # Maximum events queued for a subscriber. Events to a slower subscriber
+    # are dropped instead of blocking the scan.
+    MAX_EVENTS = 1000
+
+    def __init__(self, log_path, frame_cache_bytes=512 * 2 ** 20):
+        self.tango = gui.Tango()
+        self.devices = {}
+        self.scan_queue = scan.ScanQueue(self.devices.get, log_path,
+                                         self.tango)
+        self.frame_cache = FrameCache(frame_cache_bytes)
+        # Queued or running scan definition -> tag given by its client.
+        self._tags = {}
+        self._subscribers = []
+        self._subscribers_lock = threading.Lock()
+        # Protects |devices| and |_scan_thread|. Not held during device I/O,
+        # so a moving motor does not block other clients.
+        self._lock = threading.Lock()
+        self._scan_thread = None
+
+    def handle(self, request):
+        """Return result of |request|. Raise exception if failed. Called
+        concurrently by the threads of clients."""
+        command = request.get("command")
+        handler = getattr(self, "_do_" + str(command), None)
+        if handler is None:
+            raise ValueError("Unknown command %s." % command)
+        return handler(request)
+
+    def _get_device(self, name):
+        """Return added device |name|. Raise KeyError if not added."""
+        with self._lock:
+            if name not in self.devices:
+                raise KeyError("Device %s not added." % name)
+            return self.devices[name]
+
+    def _do_list_devices(self, request):
+        """Return names of all available devices."""
+        return self.tango.devices
+
+    def _do_get_aliases(self, request):
+        """Return dict of device name -> alias."""
+        return self.tango.aliases
+
+    def _do_get_device_class(self, request):
+        """Return the tango class of device "name"."""
+        return self.tango.get_device_class(request["name"])
+
+    def _do_add_device(self, request):
+        """Add device "name"."""
+        name = request["name"]
+        with self._lock:
+            if name in self.devices:
+                return None
+        # Creating a model reads the device, so it is done without the lock.
+        device = self.tango.create_model(name)
+        if hasattr(device, "frame_cache"):
+            device.frame_cache = self.frame_cache
+        with self._lock:
+            self.devices.setdefault(name, device)
+        return None
+
+    def _do_remove_device(self, request):
+        """Remove device "name". Refused while scanning."""
+        with self._lock:
+            if self._scan_thread:
+                raise ValueError("Cannot remove device while scanning.")
+            self.devices.pop(request["name"], None)
+        return None
+
+    def _do_get_state(self, request):
+        """Return state of added devices and of the scan queue."""
+        with self._lock:
+            added = self.devices.items()
+        devices = {}
+        for name, device in added:
+            devices[name] = {"type": device.device_type,
+                             "values": device.values,
+                             "state": device.get_state()}
+        current = self.scan_queue.current
+        policy = self.scan_queue.flush_policy
+        return {"devices": devices,
+                "scan": {"running": self.scan_queue.is_running,
+                         "pending": len(self.scan_queue),
+                         "current": current and current.to_dict(),
+                         "flush_policy": {"mode": policy.mode,
+                                          "value": policy.value,
+                                          "fsync": policy.fsync},
+                         "log_stats": self.scan_queue.log_stats}}
+
+    def _do_get_attribute(self, request):
+        """Return value of "attr" of "device"."""
+        return self._get_device(request["device"]).get_attribute(
+                request["attr"])
+
+    def _do_set_attribute(self, request):
+        """Set "attr" of "device" to "value". Return False if failed."""
+        return self._get_device(request["device"]).set_attribute(
+                request["attr"], request["value"])
+
+    def _do_validate_attribute(self, request):
+        """Return error message if "value" of "attr" of "device" is illegal,
+        otherwise None."""
+        return self._get_device(request["device"]).validate_attribute(
+                request["attr"], request["value"])
+
+    def _do_read_latest_frame(self, request):
+        """Return the latest frame of camera "device", see
+        |remote.encode_frame|."""
+        return encode_frame(
+                self._get_device(request["device"]).read_latest_frame())
+
+    def _do_get_frame_cache(self, request):
+        """Return "stats" and "max_bytes" of the frame cache."""
+        return {"stats": self.frame_cache.stats,
+                "max_bytes": self.frame_cache.max_bytes}
+
+    def _do_get_frame_keys(self, request):
+        """Return keys of cached frames, the least recently used first."""
+        return self.frame_cache.keys()
+
+    def _do_get_frame(self, request):
+        """Return cached frame "key", or None if not cached."""
+        return encode_frame(self.frame_cache.get(tuple(request["key"])))
+
+    def _do_get_latest_frame(self, request):
+        """Return "count" of frames cached for "device" and the last
+        "frame", which is None if "count" is the given one."""
+        count, image = self.frame_cache.get_latest(request["device"])
+        if count == request.get("count"):
+            image = None
+        return {"count": count, "frame": encode_frame(image)}
+
+    def _do_set_flush_policy(self, request):
+        """Set the flush policy of scan logs to "mode", "value" and
+        "fsync", see |logwriter.FlushPolicy|."""
+        self.scan_queue.flush_policy = logwriter.FlushPolicy(
+                request["mode"], request["value"], request["fsync"])
+        return None
+
+    def _do_start_scan(self, request):
+        """Queue scan "definition", a dict of |scan.ScanDefinition.to_dict|,
+        and start scanning if idle. Events of the scan carry "tag"."""
+        definition = scan.ScanDefinition.from_dict(request["definition"])
+        with self._lock:
+            missing = [name for name in definition.logging_devices
+                       if name not in self.devices]
+            if missing:
+                raise ValueError("Devices not added: %s." %
+                                 ", ".join(missing))
+            self._tags[definition] = request.get("tag")
+            self.scan_queue.append(definition)
+            self._start()
+            return len(self.scan_queue)
+
+    def _do_resume_scan(self, request):
+        """Resume the interrupted scan in "folder". Events of the scan carry
+        "tag"."""
+        with self._lock:
+            definition = self.scan_queue.resume(request["folder"])
+            self._tags[definition] = request.get("tag")
+            self._start()
+        return None
+
+    def _do_stop_scan(self, request):
+        """Stop scanning and drop pending scans."""
+        self.scan_queue.stop()
+        return None
+
+    def _start(self):
+        """Run |scan_queue| in background if it is not running. Called with
+        |_lock| held."""
+        if self._scan_thread:
+            return
+        self._scan_thread = threading.Thread(target=self._run, name="Scan")
+        self._scan_thread.daemon = True
+        self._scan_thread.start()
+
+    def _current_tag(self):
+        """Return the tag of the running scan, or None."""
+        with self._lock:
+            return self._tags.get(self.scan_queue.current)
+
+    def _on_finish(self, definition):
+        """Publish that scan |definition| is over."""
+        with self._lock:
+            tag = self._tags.pop(definition, None)
+        self.publish({"event": "done", "tag": tag})
+
+    def _run(self):
+        """Run |scan_queue| until it is empty and publish its events."""
+        on_error = lambda msg: self.publish({"event": "error",
+                                             "tag": self._current_tag(),
+                                             "message": msg})
+        on_point = lambda record: self.publish({"event": "point",
+                                                "tag": self._current_tag(),
+                                                "record": record})
+        while True:
+            try:
+                self.scan_queue.run(on_error=on_error, on_point=on_point,
+                                    on_finish=self._on_finish)
+            except Exception as err:
+                # Clients waiting for their scans must not hang.
+                on_error("Scan failed: %s" % err)
+                self.scan_queue.stop()
+            with self._lock:
+                # Scans queued meanwhile are run by this thread.
+                if not len(self.scan_queue):
+                    self._scan_thread = None
+                    # Scans dropped by a stop or a failure are over too.
+                    dropped, self._tags = self._tags.values(), {}
+                    break
+        for tag in dropped:
+            self.publish({"event": "done", "tag": tag})
+        self.publish({"event": "finish"})
+
+    def subscribe(self):
+        """Return a new queue receiving all events."""
+        events = Queue.Queue(self.MAX_EVENTS)
+        with self._subscribers_lock:
+            self._subscribers.append(events)
+        return events
+
+    def unsubscribe(self, events):
+        """Stop sending events to |events|."""
+        with self._subscribers_lock:
+            self._subscribers.remove(events)
+
+    def publish(self, event):
+        """Send |event| to all subscribers."""
+        if event["event"] == "error":
+            print "Error: %s" % event["message"]
+        with self._subscribers_lock:
+            subscribers = list(self._subscribers)
+        for events in subscribers:
+            try:
+                events.put_nowait(event)
+            except Queue.Full:
+                pass
+
+    def stop(self):
+        """Stop scanning and wait for the scan thread."""
+        self.scan_queue.stop()
+        scan_thread = self._scan_thread
+        if scan_thread:
+            scan_thread.join()
+
+
+class _RequestHandler(SocketServer.StreamRequestHandler):
+    """Serve one client connection."""
+    def handle(self):
+        engine = self.server.engine
+        for line in iter(self.rfile.readline, ""):
+            try:
+                request = json.loads(line)
+                if request.get("command") == "subscribe":
+                    self._stream(engine)
+                    return
+                response = {"ok": True, "result": engine.handle(request)}
+            except Exception as err:
+                response = {"ok": False, "error": str(err)}
+            self.wfile.write(dumps(response))
+            self.wfile.flush()
+
+    def _stream(self, engine):
+        """Send events until the client disconnects."""
+        events = engine.subscribe()
+        try:
+            self.wfile.write(dumps({"ok": True, "result": None}))
+            while True:
+                self.wfile.write(dumps(events.get()))
+                self.wfile.flush()
+        except socket.error:
+            pass
+        finally:
+            engine.unsubscribe(events)
+
+    def finish(self):
+        # Events left in the buffer of a disconnected client are dropped.
+        try:
+            SocketServer.StreamRequestHandler.finish(self)
+        except socket.error:
+            pass
+
+
+class _Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """Threaded Unix socket server holding the scan engine."""
+    daemon_threads = True
+
+    def __init__(self, socket_path, engine):
+        SocketServer.UnixStreamServer.__init__(self, socket_path,
+                                               _RequestHandler)
+        self.engine = engine
+
+
+def main():
+    """Run the daemon until interrupted."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--socket", default=SOCKET_PATH,
+                        help="path of the daemon socket")
+    parser.add_argument("--log-path", default="/home/ax01user/test/log/",
+                        help="where log folders are placed")
+    parser.add_argument("--frame-cache-mb", type=int, default=512,
+                        help="memory budget of recent frames in MB")
+    args = parser.parse_args()
+
+    if os.path.exists(args.socket):
+        try:
+            DaemonClient(args.socket).close()
+        except socket.error:
+            # Left by a daemon which has died.
+            os.remove(args.socket)
+        else:
+            print "Error: another daemon is listening on %s." % args.socket
+            sys.exit(1)
+    engine = ScanDaemon(os.path.join(args.log_path, ""),
+                        args.frame_cache_mb * 2 ** 20)
+    server = _Server(args.socket, engine)
+    print "Listening on %s." % args.socket
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+        engine.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""This module contains the search index of device names and aliases."""
+
+import bisect
+import heapq
+
+
+class DeviceIndex(object):
+    """Prefix and substring index over device names and aliases.
+
+    Keys are device names and aliases in lower case. Prefix search uses a
+    sorted list of keys, substring search uses a map from each trigram to the
+    devices whose keys contain it. Both are updated incrementally.
+
+    Args:
+        aliases (dict): device name -> alias, for devices which have one.
+
+    """
+    GRAM_SIZE = 3
+
+    def __init__(self, aliases=None):
+        self._aliases = aliases or {}
+        # Sorted list of (key, device name).
+        self._keys = []
+        # Trigram -> set of device names.
+        self._grams = {}
+        # Device name -> list of keys.
+        self._device_keys = {}
+
+    def __contains__(self, name):
+        return name in self._device_keys
+
+    def __len__(self):
+        return len(self._device_keys)
+
+    def _grams_of(self, key):
+        """Return set of trigrams of |key|."""
+        size = self.GRAM_SIZE
+        return set(key[idx:idx + size] for idx in range(len(key) - size + 1))
+
+    def add(self, name):
+        """Add device |name| and its alias to the index."""
+        if name in self._device_keys:
+            return
+        keys = [name.lower()]
+        alias = self._aliases.get(name)
+        if alias and alias.lower() != keys[0]:
+            keys.append(alias.lower())
+        self._device_keys[name] = keys
+        for key in keys:
+            bisect.insort(self._keys, (key, name))
+            for gram in self._grams_of(key):
+                self._grams.setdefault(gram, set()).add(name)
+
+    def remove(self, name):
+        """Remove device |name| and its alias from the index."""
+        keys = self._device_keys.pop(name, None)
+        if keys is None:
+            return
+        for key in keys:
+            idx = bisect.bisect_left(self._keys, (key, name))
+            del self._keys[idx]
+            for gram in self._grams_of(key):
+                names = self._grams[gram]
+                names.discard(name)
+                if not names:
+                    del self._grams[gram]
+
+    def get_alias(self, name):
+        """Return alias of device |name|, or None."""
+        return self._aliases.get(name)
+
+    def search(self, text, limit=None):
+        """Return devices whose name or alias contains |text|.
+
+        Devices with a key starting with |text| come first, in order of key.
+        The other matches follow in order of name.
+
+        Args:
+            text (str): case-insensitive text to search. Empty text matches
+                    all devices.
+            limit (int): maximum number of devices returned, or None.
+
+        """
+        text = text.lower()
+        result = []
+        found = set()
+        # Prefix matches.
+        idx = bisect.bisect_left(self._keys, (text, ""))
+        while idx < len(self._keys) and self._keys[idx][0].startswith(text):
+            name = self._keys[idx][1]
+            if name not in found:
+                found.add(name)
+                result.append(name)
+                if limit is not None and len(result) >= limit:
+                    return result
+            idx += 1
+        # Substring matches.
+        if len(text) < self.GRAM_SIZE:
+            candidates = self._device_keys.iterkeys()
+        else:
+            gram_sets = sorted((self._grams.get(gram, set())
+                                for gram in self._grams_of(text)), key=len)
+            candidates = gram_sets[0].intersection(*gram_sets[1:])
+        others = (name for name in candidates if name not in found and
+                  any(text in key for key in self._device_keys[name]))
+        if limit is None:
+            return result + sorted(others)
+        return result + heapq.nsmallest(limit - len(result), others)
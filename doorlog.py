@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# pylint: disable=too-many-instance-attributes
+"""This module contains the bounded stream of Sardana door logs.
+
+Instead of polling and copying the whole log buffers of a door, |DoorLog|
+subscribes to the output and debug log streams and consumes new lines as
+they arrive. The buffers of the log streams are cleared when a macro starts,
+so they do not grow for the whole session.
+
+"""
+
+import threading
+from collections import deque
+from itertools import islice
+
+
+class DoorLog(object):
+    """Bounded stream of output and debug logs of a Sardana door.
+
+    New lines are kept in a ring buffer of fixed size and, while a macro run
+    with a sink is running, written to it, eg. to a log in the scan folder.
+
+    Args:
+        door: Sardana door.
+        name (str): door name used in the sink.
+        size (int): number of lines kept in |lines|.
+
+    Attributes:
+        door: Sardana door.
+        name (str): door name used in the sink.
+        lines (deque): last lines as (sequence number, stream, line).
+        count (int): sequence number of the next line.
+        markers (deque): last macros as (command, sequence number at start,
+                sequence number at finish or None if running).
+
+    """
+    STREAMS = ("output", "debug")
+
+    def __init__(self, door, name, size=1000):
+        self.door = door
+        self.name = name
+        self.lines = deque(maxlen=size)
+        self.count = 0
+        self.markers = deque(maxlen=100)
+        self._lock = threading.Lock()
+        # Sink of the running macro.
+        self._sink = None
+        self._started = threading.Event()
+        for stream in self.STREAMS:
+            door.getLogObj(stream).subscribeEvent(self._on_lines, stream)
+
+    def _on_lines(self, stream, lines):
+        """Consume new |lines| of |stream|. Called by the log object."""
+        if not lines:
+            return
+        with self._lock:
+            for line in lines:
+                self.lines.append((self.count, stream, line))
+                self.count += 1
+                if self._sink:
+                    self._sink.write("%s::%s::%s\n" % (self.name, stream,
+                                                       line))
+        if stream == "debug":
+            self._started.set()
+
+    def begin_macro(self, command, sink=None):
+        """Mark the start of |command|, before it is sent to the door.
+
+        Args:
+            command (list of str): macro encapsulated in list, eg. ["wa"].
+            sink: file-like object where the lines and markers of the macro
+                    are written, or None.
+
+        """
+        # Lines are consumed by |_on_lines|, the buffers of the log streams
+        # are not read.
+        for stream in self.STREAMS:
+            self.door.getLogObj(stream).clearLogBuffer()
+        with self._lock:
+            self._sink = sink
+            self._started.clear()
+            self.markers.append((command, self.count, None))
+            if self._sink:
+                self._sink.write("%s::macro::start %s\n" %
+                                 (self.name, " ".join(command)))
+
+    def wait_started(self, timeout=None):
+        """Wait until the door logs debug output of the running macro. Return
+        False on timeout."""
+        return self._started.wait(timeout)
+
+    def end_macro(self):
+        """Mark the finish of the running macro."""
+        with self._lock:
+            command, start, _ = self.markers.pop()
+            self.markers.append((command, start, self.count))
+            if self._sink:
+                self._sink.write("%s::macro::finish %s\n" %
+                                 (self.name, " ".join(command)))
+            self._sink = None
+
+    def get_lines(self, start=0):
+        """Return (stream, line) of kept lines with sequence number from
+        |start|, eg. the start of a macro in |markers|."""
+        with self._lock:
+            first = self.count - len(self.lines)
+            return [entry[1:] for entry in
+                    islice(self.lines, max(start - first, 0), None)]
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""This module contains the scan duration estimator.
+
+The time of each phase of a scan point, eg. a motor move or the acquisition
+of a camera, is recorded per device and fitted as a linear cost
+a + b * x, where x is the size of the phase, eg. the move distance or the
+total exposure time. Old records decay, so the fits follow changes of the
+setup. The fits are kept in a JSON file and reused by later sessions.
+
+"""
+
+import json
+import os
+import threading
+
+
+class LinearCost(object):
+    """Least squares fit of seconds = a + b * x, with decayed sums."""
+    # Weight of previous records when a new one is added.
+    DECAY = 0.99
+
+    def __init__(self, sums=None):
+        # Weight, sum of x, sum of y, sum of x * x, sum of x * y.
+        self.sums = list(sums or [0.0] * 5)
+
+    def add(self, size, seconds):
+        """Record a phase of |size| which took |seconds|."""
+        self.sums = [value * self.DECAY for value in self.sums]
+        for idx, value in enumerate((1.0, size, seconds, size * size,
+                                     size * seconds)):
+            self.sums[idx] += value
+
+    def predict(self, size):
+        """Return predicted seconds of a phase of |size|, or None if no
+        record."""
+        weight, s_x, s_y, s_xx, s_xy = self.sums
+        if not weight:
+            return None
+        var = weight * s_xx - s_x * s_x
+        if var <= 1e-12 * max(1.0, weight * s_xx):
+            # All records have the same size.
+            return s_y / weight
+        slope = (weight * s_xy - s_x * s_y) / var
+        intercept = (s_y - slope * s_x) / weight
+        return max(0.0, intercept + slope * size)
+
+
+class DurationEstimator(object):
+    """Per-device phase costs learned from past scans.
+
+    Args:
+        path (str): JSON file where costs are kept.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self._costs = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path) as cost_file:
+                    for key, sums in json.load(cost_file).items():
+                        self._costs[key] = LinearCost(sums)
+            except (IOError, ValueError) as err:
+                print "Error: failed to load %s: %s" % (path, err)
+
+    @staticmethod
+    def _key(device, phase):
+        """Return key of |phase| of |device|."""
+        return "%s::%s" % (device, phase)
+
+    def tell(self, device, phase, size, seconds):
+        """Record that |phase| of |device| with |size| took |seconds|."""
+        with self._lock:
+            key = self._key(device, phase)
+            self._costs.setdefault(key, LinearCost()).add(size, seconds)
+
+    def predict(self, device, phase, size):
+        """Return predicted seconds of |phase| of |device|, or None if
+        unknown."""
+        with self._lock:
+            cost = self._costs.get(self._key(device, phase))
+            return cost.predict(size) if cost else None
+
+    def save(self):
+        """Write costs to |path|."""
+        with self._lock:
+            data = dict((key, cost.sums) for key, cost in self._costs.items())
+        try:
+            with open(self.path + ".tmp", "w") as cost_file:
+                json.dump(data, cost_file)
+            os.rename(self.path + ".tmp", self.path)
+        except (IOError, OSError) as err:
+            print "Error: failed to save %s: %s" % (self.path, err)
+
+    def estimate(self, definition, get_device):
+        """Return (seconds, points per second) predicted for |definition|, or
+        None if a phase has no record yet.
+
+        A point costs the move of the scanned attribute plus the longest log
+        of |definition.logging_devices|, which are logged concurrently.
+        Adaptive scans are assumed to use their whole budget.
+
+        Args:
+            definition (scan.ScanDefinition): scan to be estimated.
+            get_device (callable): return device model by name.
+
+        """
+        points = definition.points()
+        # Moves of the scanned attribute. Refined points of adaptive scans
+        # are assumed to be a step away from the previous one.
+        moves = [abs(value - last) for last, value in zip(points, points[1:])]
+        if definition.adaptive:
+            budget = definition.adaptive["budget"]
+            moves += [definition.step] * (budget - len(points))
+            points = (points + [points[-1]] * budget)[:budget]
+            moves = moves[:budget - 1]
+        # Device name -> attribute values during the scan.
+        values = {}
+        for device_name, attr, val in definition.static_values:
+            values.setdefault(device_name, {})[attr] = val
+        devices = [get_device(name) for name in definition.logging_devices]
+        if None in devices:
+            return None
+        total = 0.0
+        for idx, value in enumerate(points):
+            values.setdefault(definition.device, {})[definition.attr] = value
+            seconds = 0.0
+            if idx:
+                seconds = self.predict(definition.device,
+                                       "set " + definition.attr,
+                                       moves[idx - 1])
+                if seconds is None:
+                    return None
+            logs = []
+            for device in devices:
+                log = 0.0
+                for phase, size in device.get_log_costs(
+                        values.get(device.device_name, {})):
+                    cost = self.predict(device.device_name, phase, size)
+                    if cost is None:
+                        return None
+                    log += cost
+                logs.append(log)
+            total += seconds + max(logs or [0.0])
+        return total, len(points) / total if total else 0.0
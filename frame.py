@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""This module contains helper functions for camera frames."""
+
+import math
+import struct
+
+import numpy as np
+
+# Magic number of Lima DATA_ARRAY images.
+DATA_ARRAY_MAGIC = struct.unpack(">I", "DTAY")[0]
+# magic, version, header size, category, data type, endianness, number of
+# dimensions, 6 dimensions, 6 steps.
+_DATA_ARRAY_HEADER = struct.Struct("<IHHIIHHHHHHHHIIIIII")
+_DATA_ARRAY_TYPES = {0: np.uint8, 1: np.uint16, 2: np.uint32, 3: np.uint64,
+                     4: np.int8, 5: np.int16, 6: np.int32, 7: np.int64,
+                     8: np.float32, 9: np.float64}
+# Lima image type -> pixel type of raw files.
+IMAGE_TYPES = {"Bpp8": np.uint8, "Bpp8S": np.int8, "Bpp10": np.uint16,
+               "Bpp10S": np.int16, "Bpp12": np.uint16, "Bpp12S": np.int16,
+               "Bpp14": np.uint16, "Bpp14S": np.int16, "Bpp16": np.uint16,
+               "Bpp16S": np.int16, "Bpp32": np.uint32, "Bpp32S": np.int32,
+               "Bpp32F": np.float32}
+
+
+def decode_image(result):
+    """Return 2-D numpy array of an image returned by LimaCCDs |readImage|.
+
+    Args:
+        result: ("DATA_ARRAY", bytes) for DevEncoded images, or numpy array.
+
+    """
+    if isinstance(result, np.ndarray):
+        return result
+    data_format, data = result
+    if data_format != "DATA_ARRAY":
+        raise ValueError("Unsupported image format %s." % data_format)
+    header = _DATA_ARRAY_HEADER.unpack_from(data)
+    magic, header_size, data_type, big_endian, nb_dim = \
+            header[0], header[2], header[4], header[5], header[6]
+    if magic != DATA_ARRAY_MAGIC:
+        raise ValueError("Bad DATA_ARRAY magic number %#x." % magic)
+    dtype = np.dtype(_DATA_ARRAY_TYPES[data_type])
+    dtype = dtype.newbyteorder(">" if big_endian else "<")
+    width, height = header[7], header[8] if nb_dim > 1 else 1
+    return np.frombuffer(data, dtype=dtype, count=width * height,
+                         offset=header_size).reshape((height, width))
+
+
+def read_frame(tango_device, image_idx):
+    """Return 2-D numpy array of image |image_idx| in camera memory.
+
+    Args:
+        tango_device: proxy of LimaCCDs device.
+        image_idx (int): index of the image in the current acquisition.
+
+    """
+    return decode_image(tango_device.readImage(image_idx))
+
+
+def open_raw(path, width, height, image_type):
+    """Return 2-D numpy array memory-mapped on a raw file saved by Lima.
+
+    Args:
+        path (str): path of the raw file.
+        width (int): image width.
+        height (int): image height.
+        image_type (str): Lima image type, eg. Bpp16.
+
+    """
+    return np.memmap(path, dtype=IMAGE_TYPES[image_type], mode="r",
+                     shape=(height, width))
+
+
+def to_pgm(image, width, height):
+    """Return |image| as binary PGM bytes, downsampled by block means to fit
+    |width| x |height| and stretched to the full grey range.
+
+    Args:
+        image (numpy.ndarray): 2-D image.
+        width (int): maximum width in pixels.
+        height (int): maximum height in pixels.
+
+    """
+    step = max(1, int(math.ceil(max(image.shape[0] / float(height),
+                                    image.shape[1] / float(width)))))
+    rows, cols = image.shape[0] // step, image.shape[1] // step
+    if rows and cols:
+        small = image[:rows * step, :cols * step].reshape(
+                rows, step, cols, step).mean(axis=(1, 3), dtype=np.float32)
+    else:
+        small = image[::step, ::step].astype(np.float32)
+    low, high = small.min(), small.max()
+    scale = 255.0 / (high - low) if high > low else 0.0
+    pixels = ((small - low) * scale).astype(np.uint8)
+    return "P5\n%d %d\n255\n" % (pixels.shape[1], pixels.shape[0]) + \
+            pixels.tostring()
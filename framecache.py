@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""This module contains the in-process cache of recent camera frames.
+
+Frames read by the acquisition path are kept in memory up to a byte budget,
+so the preview, reductions and the frame browser do not fetch them again.
+The least recently used frames are evicted first.
+
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class FrameCache(object):
+    """LRU cache of frames with a byte-size limit.
+
+    Frames are keyed by (scan id, device name, frame number), where the frame
+    number is the number of the frame in its |container|.
+
+    Args:
+        max_bytes (int): maximum total size of cached frames.
+
+    Attributes:
+        max_bytes (int): maximum total size of cached frames.
+        stats (dict): "frames", "bytes", "hits", "misses" and "evictions".
+
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.stats = {"frames": 0, "bytes": 0, "hits": 0, "misses": 0,
+                      "evictions": 0}
+        self._frames = OrderedDict()
+        # Device name -> (number of frames put, key of the last one).
+        self._latest = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __contains__(self, key):
+        return key in self._frames
+
+    def put(self, key, image):
+        """Cache numpy array |image| under |key|. Frames larger than
+        |max_bytes| are not cached."""
+        with self._lock:
+            device = key[1]
+            count = self._latest.get(device, (0, None))[0]
+            self._latest[device] = (count + 1, key)
+            if image.nbytes > self.max_bytes:
+                return
+            if key in self._frames:
+                self.stats["bytes"] -= self._frames.pop(key).nbytes
+            self._frames[key] = image
+            self.stats["bytes"] += image.nbytes
+            while self.stats["bytes"] > self.max_bytes:
+                self.stats["bytes"] -= self._frames.popitem(last=False)[1] \
+                        .nbytes
+                self.stats["evictions"] += 1
+            self.stats["frames"] = len(self._frames)
+
+    def get(self, key):
+        """Return frame of |key|, or None if not cached."""
+        with self._lock:
+            image = self._frames.pop(key, None)
+            if image is None:
+                self.stats["misses"] += 1
+                return None
+            # Most recently used frames are at the end.
+            self._frames[key] = image
+            self.stats["hits"] += 1
+            return image
+
+    def get_latest(self, device):
+        """Return (number of frames put for |device|, last frame), the frame
+        being None if it is not cached. Callers compare the number to detect
+        new frames."""
+        with self._lock:
+            count, key = self._latest.get(device, (0, None))
+            return count, self._frames.get(key)
+
+    def keys(self):
+        """Return keys of cached frames from least to most recently used."""
+        with self._lock:
+            return self._frames.keys()
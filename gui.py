@@ -6,97 +6,262 @@ Tkinter is used for GUI.
 
 """
 
-import datetime
-import os
+import argparse
+import socket
+import threading
 import time
 import Tkinter as tk
+import tkFileDialog
 import tkMessageBox
 import sys
-from collections import deque
+import Queue
+from collections import OrderedDict, deque
 from Tkinter import N, S, E, W
 
 import PyTango
 from sardana.taurus.core.tango.sardana.macroserver import BaseDoor
 
+import history
+import model
+import remote
+import scan
 import widget
-from helper import is_number
+from device_index import DeviceIndex
+from doorlog import DoorLog
+from framecache import FrameCache
+from helper import format_duration, is_integer, is_number
 
 class Tango(object):
     """Interact with Tango system.
 
     Attributes:
         _db: instance of Tango database.
-        door: instance of Sardana door.
-        debug: debug-level log stream of Sardana.
-        output: output-level log stream of Sardana.
+        doors (list): instances of all Sardana doors.
+        door_logs (list of DoorLog): log streams of |doors|.
+        door: instance of the first Sardana door.
         device_classes (list of str): supported device classes.
         devices (str): all devices found under classes |device_classes|.
+        aliases (dict): device name -> alias, for devices which have one.
 
     """
     def __init__(self):
         self._db = PyTango.Database()
-        door_name = self.find_door()
-        if not door_name:
-            tkMessageBox.showerror("Error", "No Sardana door found.")
-            sys.exit(1)
-        print door_name
-        door_full_name = "%s:%s/%s" % \
-                (self._db.get_db_host(), self._db.get_db_port(), door_name)
-        # Sardana door.
-        self.door = BaseDoor(door_full_name)
-        # Debug, Output stream of door log.
-        self.debug = self.door.getLogObj('debug')
-        self.output = self.door.getLogObj('output')
+        door_names = self.find_doors()
+        if not door_names:
+            raise RuntimeError("No Sardana door found.")
+        print door_names
+        # Sardana doors.
+        self.doors = []
+        self.door_logs = []
+        for door_name in door_names:
+            door_full_name = "%s:%s/%s" % \
+                    (self._db.get_db_host(), self._db.get_db_port(), door_name)
+            door = BaseDoor(door_full_name)
+            self.doors.append(door)
+            self.door_logs.append(DoorLog(door, door_name))
+        self.door = self.doors[0]
+        # Log streams of doors which are not running a macro.
+        self._free_doors = Queue.Queue()
+        for door_log in self.door_logs:
+            self._free_doors.put(door_log)
+        # Thread id -> sink of the door logs of macros run by the thread.
+        self._log_sinks = {}
 
         self.device_classes = ["Motor", "LimaCCDs"]
         self.devices = []
         for class_type in self.device_classes:
             self.devices.extend(self._db.get_device_exported_for_class(class_type).value_string)
+        self.aliases = self._find_aliases()
+
+    def _find_aliases(self):
+        """Return dict of device name -> alias for all aliases in database.
+
+        All aliases are fetched by a single query of the database device.
+        If the query is refused, aliases are resolved one by one when needed
+        by |get_device_alias|.
+
+        """
+        try:
+            reply = self._db.command_inout(
+                    "DbMySqlSelect", "SELECT name, alias FROM device "
+                    "WHERE alias IS NOT NULL AND alias != ''")
+        except PyTango.DevFailed as err:
+            print "Error: failed to load aliases: %s" % err
+            return {}
+        # Values of each row one after another, 2 columns.
+        values = reply[1]
+        return dict(zip(values[0::2], values[1::2]))
 
     def get_device_alias(self, device):
         """Return the alias of |device|."""
-        return self._db.get_alias_from_device(device)
+        if device not in self.aliases:
+            self.aliases[device] = self._db.get_alias_from_device(device)
+        return self.aliases[device]
 
     def get_device_class(self, device):
         """Return the tango class of |device|."""
         return self._db.get_class_for_device(device)
 
-    def is_sardana_running(self):
-        """Return True if sardana is at state ON instead of RUNNING, OFF."""
-        return self.door.getState() == PyTango.DevState.RUNNING
+    @staticmethod
+    def get_device_proxy(device_name):
+        """Return a new tango device proxy of |device_name|."""
+        return PyTango.DeviceProxy(device_name)
+
+    def create_model(self, device_name):
+        """Return a new device model of |device_name|, eg. MotorModel for
+        a device of class Motor."""
+        device_class = self.get_device_class(device_name)
+        return getattr(model, device_class + "Model")(self, device_name)
+
+    def is_sardana_running(self, door=None):
+        """Return True if sardana is at state ON instead of RUNNING, OFF.
+
+        Args:
+            door: door to be checked. Default is |door|.
+
+        """
+        door = door or self.door
+        return door.getState() == PyTango.DevState.RUNNING
 
-    def find_door(self):
-        """Return door name. Return None if not found.
+    def find_doors(self):
+        """Return list of door names.
 
-        Find door under server pattern MacroServer*.
+        Find doors under server pattern MacroServer*. Only the doors of the
+        MacroServer of the first door are returned, as another MacroServer
+        may not know the same motors.
 
         """
         server_list = self._db.get_server_list('MacroServer/*').value_string
         for server in server_list:
             server_devs = self._db.get_device_class_list(server).value_string
             devs, classes = server_devs[0::2], server_devs[1::2]
-            for idx, class_ in enumerate(classes):
-                if class_.lower() == "door":
-                    return devs[idx]
-        return None
+            doors = [devs[idx] for idx, class_ in enumerate(classes)
+                     if class_.lower() == "door"]
+            if doors:
+                owner = self._get_macro_server(doors[0])
+                return [door for door in doors
+                        if self._get_macro_server(door) == owner]
+        return []
+
+    def _get_macro_server(self, door):
+        """Return the MacroServer property of |door|, a list of names."""
+        return list(self._db.get_device_property(
+                door, "MacroServerName")["MacroServerName"])
+
+    def run_macro(self, command, sink=None):
+        """Run macro on a free Sardana door. Wait for a door if all of them
+        are busy.
 
-    def run_macro(self, command):
-        """Run macro on Sardana.
+        Args:
+            command (list of str): macro encapsulated in list, eg. ["wa"].
+            sink: where the door logs of the macro are written. Default is
+                    the sink set by |set_log_sink| in this thread.
+
+        """
+        sink = sink or self.get_log_sink()
+        door_log = self._free_doors.get()
+        try:
+            self._run_macro_on_door(door_log, command, sink)
+        finally:
+            self._free_doors.put(door_log)
+
+    def _run_macro_on_door(self, door_log, command, sink=None):
+        """Run macro on the door of |door_log| and wait for it to finish.
 
         Args:
+            door_log (DoorLog): log stream of the door.
             command (list of str): macro encapsulated in list, eg. ["wa"].
+            sink: where the door logs of the macro are written, or None.
 
         """
-        self.output.clearLogBuffer()
-        self.debug.clearLogBuffer()
-        self.door.runmacro(command)
+        door_log.begin_macro(command, sink)
+        door_log.door.runmacro(command)
         # Wait for attribute change finish.
-        while not self.debug.getLogBuffer():
-            time.sleep(0.05)
-        while self.is_sardana_running():
+        while not door_log.wait_started(0.05):
+            pass
+        while self.is_sardana_running(door_log.door):
             time.sleep(0.05)
-        # print self.output.getLogBuffer()
-        # print self.debug.getLogBuffer()
+        door_log.end_macro()
+
+    @staticmethod
+    def get_move_macro(targets):
+        """Return the mv macro moving all motors of |targets| together.
+
+        Args:
+            targets (list of tuple): (motor alias, position).
+
+        """
+        command = ["mv"]
+        for alias, position in targets:
+            command += [alias, str(position)]
+        return command
+
+    def move(self, targets, sink=None):
+        """Move motors together with a single mv macro and wait for all of
+        them to stop.
+
+        Args:
+            targets (list of tuple): (motor alias, position).
+            sink: where the door logs of the move are written. Default is
+                    the sink set by |set_log_sink| in this thread.
+
+        """
+        self.run_macro(self.get_move_macro(targets), sink)
+
+    def get_log_sink(self):
+        """Return the sink set by |set_log_sink| in this thread, or None."""
+        return self._log_sinks.get(threading.current_thread().ident)
+
+    def set_log_sink(self, sink):
+        """Write door logs of the macros run by this thread to |sink|, a
+        file-like object, or stop writing if None.
+
+        Sinks are set per thread, so the macros which stage the next scan
+        in background are not logged with the running scan.
+
+        """
+        ident = threading.current_thread().ident
+        if sink is None:
+            self._log_sinks.pop(ident, None)
+        else:
+            self._log_sinks[ident] = sink
+
+    def run_macros(self, macros):
+        """Run independent macros concurrently on free Sardana doors. Return
+        list of errors.
+
+        Macros with the same key, eg. macros using the same hardware, are run
+        one after another. A failed macro stops the following macros of its
+        key only.
+
+        Args:
+            macros (list of tuple): (key, command) of macros.
+
+        """
+        sink = self.get_log_sink()
+        groups = OrderedDict()
+        for key, command in macros:
+            groups.setdefault(key, []).append(command)
+        errors = []
+        def run_group(commands):
+            """Run |commands| in order."""
+            for command in commands:
+                try:
+                    self.run_macro(command, sink)
+                except Exception as err: # pylint: disable=broad-except
+                    errors.append("Failed to run macro %s: %s" %
+                                  (" ".join(command), err))
+                    return
+        if len(groups) == 1:
+            run_group(groups.values()[0])
+        else:
+            threads = [threading.Thread(target=run_group, args=(commands,))
+                       for commands in groups.values()]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        return errors
 
 
 class Application(tk.Frame):
@@ -108,51 +273,97 @@ class Application(tk.Frame):
 
     Args:
         master (tk.Widget): reference to parent widget.
+        client (remote.DaemonClient): connection to the scan engine daemon,
+                or None to run scans in this process.
+        frame_cache_bytes (int): memory budget of |frame_cache|. Frames of
+                scans run by the daemon are cached by the daemon, whose budget
+                is set by its own option.
+        history_bytes (int): memory budget of |history|.
+        poll_interval (float): seconds between reads of the visible devices
+                into |history|.
 
     Attributes:
-        tango (Tango): tango control system interface.
-        devices (list of str): name of available devices, excluding added ones.
+        tango (Tango): tango control system interface, or
+                |remote.RemoteTango| when attached to the daemon.
+        devices (DeviceIndex): available devices, excluding added ones.
         added_devices (list of str): name of added devices.
+        scan_queue (scan.ScanQueue): scans to be run back to back, or
+                |remote.RemoteScanQueue| run by the daemon.
+        history (history.History): values of added devices over time.
+        frame_cache (FrameCache): recent frames logged by cameras, or
+                |remote.RemoteFrameCache| when attached to the daemon.
 
     """
-    def __init__(self, master):
+    def __init__(self, master, client=None, frame_cache_bytes=512 * 2 ** 20,
+                 history_bytes=history.DEFAULT_MAX_BYTES, poll_interval=0.1):
         tk.Frame.__init__(self, master)
 
         # Load data from tango.
-        self.tango = Tango()
-        self.devices = sorted(self.tango.devices)
+        try:
+            self.tango = remote.RemoteTango(client) if client else Tango()
+        except RuntimeError as err:
+            tkMessageBox.showerror("Error", str(err))
+            sys.exit(1)
+        self.devices = DeviceIndex(self.tango.aliases)
+        for device_name in self.tango.devices:
+            self.devices.add(device_name)
         self.added_devices = []
+        # Frames of scans run by the daemon are cached by the daemon.
+        if client:
+            self.frame_cache = remote.RemoteFrameCache(client)
+        else:
+            self.frame_cache = FrameCache(frame_cache_bytes)
 
         # Where log files are placed.
         self.log_path = "/home/ax01user/test/log/"
+        if client:
+            self.scan_queue = remote.RemoteScanQueue(client, self.log_path)
+        else:
+            self.scan_queue = scan.ScanQueue(self.get_device, self.log_path,
+                                             self.tango)
 
         # Render the layout.
         self._configure_master()
         self._create_widgets()
 
+        # Record attribute values of added devices.
+        self.history = history.History(max_bytes=history_bytes)
+        # Polling pauses during scans, whose logged quantities are recorded
+        # by |_on_scan_point| instead. Devices scrolled out of view are read
+        # less often.
+        self.poller = history.Poller(
+                self.history, lambda: list(self.device_panel.models),
+                poll_interval, is_paused=lambda: self.scan_queue.is_running,
+                is_visible=lambda device: self.device_panel.is_visible(
+                        device.device_name))
+        self.poller.start()
+
     def _add_device(self):
         """Add device entry.
 
-        Triggered by |add_device_btn|. Maintain lists |devices| and
-        |added_devices|, menus |device_menu| and |scannable_device_menu| as
-        well.
+        Triggered by |add_device_btn|. Maintain index |devices|, list
+        |added_devices| and menu |scannable_device_menu| as well.
 
         """
-        device_name = self.selected_device.get()
+        device_name = self.device_picker.get()
         # Avoid unspecified device.
-        if device_name == "-":
+        if device_name is None:
             return
-        device_class = self.tango.get_device_class(device_name)
-        # Create device instance.
-        device = getattr(widget, device_class + "Device") \
-                (self, self.device_workspace_frame, device_name)
-        device.grid(row=0, column=len(self.device_workspace_frame.children),
-                    sticky=(N, S), padx=5)
+        self.add_device(device_name)
+
+    def add_device(self, device_name):
+        """Add device |device_name|, which must be in |devices|."""
+        # Create device model. Its widget is built by |device_panel| when
+        # visible.
+        device = self.tango.create_model(device_name)
+        if hasattr(device, "frame_cache"):
+            device.frame_cache = self.frame_cache
+        self.device_panel.add(device)
         self.added_devices.append(device_name)
         self._update_menu(self.scannable_device_menu,
                           self.selected_scannable_device, self.added_devices)
         self.devices.remove(device_name)
-        self._update_menu(self.device_menu, self.selected_device, self.devices)
+        self.device_picker.refresh()
 
     def _add_scan(self):
         """Add scan entry.
@@ -165,7 +376,11 @@ class Application(tk.Frame):
         # Avoid unspecified device or attr.
         if device == "-" or attr == "-":
             return
-        entry = widget.ScanEntry(self.scan_workspace_frame, device, attr)
+        monitors = ["%s::%s" % (device_model.device_name, quantity)
+                    for device_model in self.device_panel.models
+                    for quantity in device_model.quantities]
+        entry = widget.ScanEntry(self.scan_workspace_frame, device, attr,
+                                 monitors, self._update_estimate)
         entry.grid(row=len(self.scan_workspace_frame.children), column=0,
                    sticky=(E, W), pady=3)
 
@@ -206,11 +421,20 @@ class Application(tk.Frame):
         self.setting_menu.add_separator()
         self.setting_menu.add_command(label="Quit", command=self.quit)
         self.menubar.add_cascade(label="Setting", menu=self.setting_menu)
+        self.scan_menu = tk.Menu(self.menubar, tearoff=0)
+        self.scan_menu.add_command(label="Resume...",
+                                   command=self._resume_scan)
+        self.menubar.add_cascade(label="Scan", menu=self.scan_menu)
+        self.view_menu = tk.Menu(self.menubar, tearoff=0)
+        self.view_menu.add_command(label="Trend",
+                                   command=self._open_trend_plot)
+        self.view_menu.add_command(label="Frames",
+                                   command=self._open_frame_browser)
+        self.menubar.add_cascade(label="View", menu=self.view_menu)
         self.help_menu = tk.Menu(self.menubar, tearoff=0)
         self.help_menu.add_command(label="About", command=self._open_about)
         self.menubar.add_cascade(label="Help", menu=self.help_menu)
 
-        # TODO: scrollbar
         # Scan.
         self.scan_frame = tk.LabelFrame(self, text="Scan")
         self.scan_start_btn = tk.Button(self.scan_frame, text="Start",
@@ -218,6 +442,8 @@ class Application(tk.Frame):
                                         command=self._start_scan)
         self.scan_stop_btn = tk.Button(self.scan_frame, text="Stop", fg="white",
                                        bg="red", command=self._stop_scan)
+        self.scan_queue_btn = tk.Button(self.scan_frame, text="Queue (0)",
+                                        command=self._queue_scan)
         self.selected_scannable_device = tk.StringVar(self.scan_frame, "-")
         self.selected_scannable_device.trace("w", self._on_scannable_device_change)
         self.scannable_device_menu = \
@@ -232,20 +458,20 @@ class Application(tk.Frame):
         self.scan_workspace_frame = tk.Frame(self.scan_frame)
         # Device.
         self.device_frame = tk.LabelFrame(self, text="Device")
-        self.selected_device = tk.StringVar(self.device_frame, "-")
-        self.device_menu = tk.OptionMenu(self.device_frame,
-                                         self.selected_device,
-                                         *self.devices)
+        self.device_picker = widget.DevicePicker(self.device_frame,
+                                                 self.devices,
+                                                 command=self._add_device)
         self.add_device_btn = tk.Button(self.device_frame, text="Add",
                                         command=self._add_device)
-        self.device_workspace_frame = tk.Frame(self.device_frame)
+        self.device_panel = widget.DevicePanel(self, self.device_frame)
 
         # Grid.
         # Scan.
         self.scan_frame.grid(row=0, column=0, sticky=(N, S, E, W),
                              padx=10, pady=10)
-        self.scan_start_btn.grid(row=0, column=0, columnspan=2, sticky=(E, W),
+        self.scan_start_btn.grid(row=0, column=0, sticky=(E, W),
                                  padx=(10, 5))
+        self.scan_queue_btn.grid(row=0, column=1, sticky=(E, W), padx=(5, 5))
         self.scan_stop_btn.grid(row=0, column=2, sticky=(E, W), padx=(5, 10))
         self.scannable_device_menu.grid(row=1, column=0, sticky=(E, W),
                                         padx=(7, 0))
@@ -257,11 +483,11 @@ class Application(tk.Frame):
         # Device.
         self.device_frame.grid(row=1, column=0, sticky=(N, S, E, W),
                                padx=10, pady=10)
-        self.device_menu.grid(row=0, column=0, sticky=(E, W), padx=(7, 0))
-        self.add_device_btn.grid(row=0, column=1, sticky=(E, W), padx=(9, 10))
-        self.device_workspace_frame.grid(row=1, column=0,
-                                         columnspan=2, sticky=(N, S, E, W),
-                                         padx=10, pady=(3, 8))
+        self.device_picker.grid(row=0, column=0, sticky=(E, W), padx=(10, 0))
+        self.add_device_btn.grid(row=0, column=1, sticky=(N, E, W),
+                                 padx=(9, 10))
+        self.device_panel.grid(row=1, column=0, columnspan=2,
+                               sticky=(N, S, E, W), padx=10, pady=(3, 8))
 
         # Grid config.
         # Main.
@@ -277,7 +503,6 @@ class Application(tk.Frame):
         self.device_frame.rowconfigure(1, weight=1)
         self.device_frame.columnconfigure(0, weight=4)
         self.device_frame.columnconfigure(1, weight=1)
-        self.device_workspace_frame.rowconfigure(0, weight=1)
 
     def _on_scannable_device_change(self, *args):
         """On |scannable_device_menu| change.
@@ -289,12 +514,9 @@ class Application(tk.Frame):
             self._update_menu(self.scannable_attr_menu,
                               self.selected_scannable_attr, [])
             return
-        device = self.device_workspace_frame.children[device_name.lower()]
-        attributes = []
-        for attr in device.scannable_attr:
-            attributes.append(attr.name)
+        device = self.device_panel.get(device_name)
         self._update_menu(self.scannable_attr_menu,
-                          self.selected_scannable_attr, attributes)
+                          self.selected_scannable_attr, device.scannable_attr)
 
     def _open_about(self):
         """Open about menu."""
@@ -302,104 +524,251 @@ class Application(tk.Frame):
 
     def _open_log_setting(self):
         """Open log setting menu."""
-        # TODO.
-        log_setting_win = tk.Toplevel(self.master)
+        widget.LogSetting(self.master, self.scan_queue)
+
+    def _open_trend_plot(self):
+        """Open trend plot of attribute history."""
+        widget.TrendPlot(self.master, self.history)
+
+    def _open_frame_browser(self):
+        """Open browser of cached frames."""
+        widget.FrameBrowser(self.master, self.frame_cache, self.log_path)
 
     def remove_device(self, device):
         """Remove device entry.
 
-        Triggered by |widget.DeviceBase.delete_btn|. Maintain lists |devices|
-        and |added_devices|, menus |device_menu| and |scannable_device_menu| as
-        well. Also, remove scan entries related to device.
+        Triggered by |widget.DeviceBase.delete_btn|. Maintain index |devices|,
+        list |added_devices| and menu |scannable_device_menu| as well. Also,
+        remove scan entries related to device.
 
         """
+        self.device_panel.remove(device)
+        self.history.remove(device)
         self.added_devices.remove(device)
         self._update_menu(self.scannable_device_menu,
                           self.selected_scannable_device, self.added_devices)
-        self.devices.append(device)
-        list.sort(self.devices)
-        self._update_menu(self.device_menu, self.selected_device, self.devices)
+        self.devices.add(device)
+        self.device_picker.refresh()
 
         for entry in self.scan_workspace_frame.children.values():
             if entry.device == device:
                 entry.destroy()
 
-    def _start_scan(self):
-        """Start scanning.
+    def get_device(self, device_name):
+        """Return the device model of |device_name|, or None if not added."""
+        return self.device_panel.get(device_name)
+
+    def _make_scan_definition(self, scan_entry=None, show_errors=True):
+        """Return scan definition of |scan_entry|, or of the enabled scan entry
+        if None.
 
         Contains folloing steps:
-            1. Get entry to be scanned. Return if none.
-            2. Get scanning start, end and step value. Return if illegal.
-            3. Disable all widgets to prevent value change during scanning.
-            4. Set value of attributes for all related devices (device with
-               |is_always_log| set to True or device to be scanned.)
+            1. Get entry to be scanned. Return None if none.
+            2. Get scanning start, end and step value. Return None if illegal.
+            3. Get adaptive scan monitor, budget and tolerance if enabled.
+               Return None if illegal.
+            4. Collect value of attributes for all related devices (device with
+               |is_always_log| set to True or device to be scanned.) Return
+               None if illegal.
+
+        Errors are shown in message boxes if |show_errors| is True.
         """
-        scan_entry = None
-        for entry in self.scan_workspace_frame.children.values():
-            if entry.enabled.get() == 1:
-                scan_entry = entry
-                break
+        def show_error(message):
+            """Show |message| if |show_errors| is True."""
+            if show_errors:
+                tkMessageBox.showerror("Error", message)
+
+        if scan_entry is None:
+            for entry in self.scan_workspace_frame.children.values():
+                if entry.enabled.get() == 1:
+                    scan_entry = entry
+                    break
         if not scan_entry:
-            tkMessageBox.showwarning("Warning", "No attributes to be scanned.")
-            return
+            if show_errors:
+                tkMessageBox.showwarning("Warning",
+                                         "No attributes to be scanned.")
+            return None
 
         start = is_number(scan_entry.start_entry.get())
         end = is_number(scan_entry.end_entry.get())
         step = is_number(scan_entry.step_entry.get())
-        if start is None or end is None or step is None:
-            tkMessageBox.showerror("Error",
-                    "Illegal start, end or step value of %s::%s." \
-                    % (scan_entry.device, scan_entry.attr))
-            return
-
-        self.change_state(self, False)
-        self.change_state(self.scan_stop_btn, True)
+        if start is None or end is None or step is None or step <= 0:
+            show_error("Illegal start, end or step value of %s::%s." %
+                       (scan_entry.device, scan_entry.attr))
+            return None
+
+        adaptive = None
+        if scan_entry.is_adaptive.get() == 1:
+            monitor = scan_entry.selected_monitor.get()
+            budget = is_integer(scan_entry.budget_entry.get())
+            tolerance = is_number(scan_entry.tolerance_entry.get())
+            if monitor == "-" or budget is None or budget <= 0 or \
+                    tolerance is None or tolerance < 0:
+                show_error("Illegal monitor, budget or tolerance value of "
+                           "%s::%s." % (scan_entry.device, scan_entry.attr))
+                return None
+            adaptive = {"monitor": monitor.rsplit("::", 1), "budget": budget,
+                        "tolerance": tolerance}
 
         logging_devices = []
-        # Set value for device attributes.
-        for device in self.device_workspace_frame.children.values():
+        static_values = []
+        for device in self.device_panel.models:
             if device.is_always_log or device.device_name == scan_entry.device:
-                print "Debug: set value for device %s." % device.device_name
                 if device.device_name == scan_entry.device:
                     # Put scanning device at the front of |logging_devices|.
-                    logging_devices.insert(0, device)
+                    logging_devices.insert(0, device.device_name)
                 else:
-                    logging_devices.append(device)
+                    logging_devices.append(device.device_name)
                 all_attr = device.common_attr + device.other_attr
                 for attr in all_attr:
-                    val = is_number(attr.value_widget.get())
+                    if device.device_name == scan_entry.device and \
+                            attr == scan_entry.attr:
+                        # Set at the first point of scanning.
+                        continue
+                    val = is_number(device.values[attr])
                     if val is None:
-                        tkMessageBox.showerror("Error",
-                                "Invalid value of %s::%s." \
-                                % (device.device_name, attr.name))
-                    if not device.set_attribute(attr.name, val):
-                        tkMessageBox.showerror("Error",
-                                "Failed to set attribute %s::%s." \
-                                % (device.device_name, attr.name))
-
-        scan_id = datetime.datetime.now().strftime("%d%m%Y_%H%M%S")
-        file_name = scan_id + ".log"
-        folder_path = self.log_path + scan_id + "/"
-        os.mkdir(folder_path)
-        out_file = open(folder_path + file_name, "w")
-        value = start
-        while value <= end:
-            if not logging_devices[0].set_attribute(scan_entry.attr, value):
-                tkMessageBox.showerror("Error",
-                        "Failed to scan attribute %s::%s." \
-                        % (scan_entry.device, scan_entry.attr))
-                break
-            for device in logging_devices:
-                device.log(out_file)
-            value += step
-        out_file.close()
-        self._stop_scan()
+                        show_error("Invalid value of %s::%s." %
+                                   (device.device_name, attr))
+                        return None
+                    static_values.append((device.device_name, attr, val))
+        if adaptive and adaptive["monitor"][0] not in logging_devices:
+            logging_devices.append(adaptive["monitor"][0])
+        definition = scan.ScanDefinition(scan_entry.device, scan_entry.attr,
+                                         start, end, step, static_values,
+                                         logging_devices, adaptive)
+        # The coarse pass must cover the whole range.
+        if adaptive and adaptive["budget"] < len(definition.points()):
+            show_error("Budget of %s::%s is smaller than the %d points of the "
+                       "coarse pass." % (scan_entry.device, scan_entry.attr,
+                                         len(definition.points())))
+            return None
+        return definition
+
+    def _update_estimate(self, scan_entry):
+        """Show the estimated duration of |scan_entry|, learned from past
+        scans by |scan_queue.estimator|."""
+        if self.scan_queue.is_running:
+            return
+        definition = self._make_scan_definition(scan_entry, show_errors=False)
+        estimate = definition and self.scan_queue.estimator.estimate(
+                definition, self.get_device)
+        if estimate:
+            scan_entry.set_estimate("Estimated %s, %.2f points/s" %
+                                    (format_duration(estimate[0]),
+                                     estimate[1]))
+        elif definition:
+            scan_entry.set_estimate("No timing of these devices yet.")
+        else:
+            scan_entry.set_estimate("")
 
-    def _stop_scan(self):
-        """Stop scanning."""
-        self.change_state(self, True)
+    def _queue_scan(self):
+        """Append the enabled scan entry to |scan_queue|.
+
+        Triggered by |scan_queue_btn|.
+
+        """
+        definition = self._make_scan_definition()
+        if definition is None:
+            return
+        self.scan_queue.append(definition)
+        self.scan_queue_btn.config(text="Queue (%d)" % len(self.scan_queue))
+
+    def _resume_scan(self):
+        """Resume an interrupted scan from the point after the last completed
+        one.
+
+        Triggered by menu Scan > Resume. Devices of the scan which are not
+        added yet are added first.
+
+        """
+        if self.scan_queue.is_running:
+            return
+        folder_path = tkFileDialog.askdirectory(initialdir=self.log_path,
+                                                title="Resume scan")
+        if not folder_path:
+            return
+        try:
+            definition = self.scan_queue.resume(folder_path)
+        except (IOError, KeyError) as err:
+            tkMessageBox.showerror("Error",
+                    "Failed to resume scan in %s: %s" % (folder_path, err))
+            return
+        device_names = set(definition.logging_devices)
+        device_names.update(value[0] for value in definition.static_values)
+        for device_name in device_names:
+            if not self.device_panel.get(device_name) and \
+                    device_name in self.devices:
+                self.add_device(device_name)
+        self._start_scan()
+
+    def _start_scan(self):
+        """Start scanning.
+
+        Run all scans in |scan_queue| back to back. If the queue is empty, the
+        enabled scan entry is queued first. Widgets are disabled to prevent
+        value change during scanning.
+        """
+        if not self.scan_queue:
+            self._queue_scan()
+            if not self.scan_queue:
+                return
+
+        self._set_scanning(True)
+        try:
+            self.scan_queue.run(
+                    on_error=lambda msg: tkMessageBox.showerror("Error", msg),
+                    on_point=self._on_scan_point)
+        finally:
+            self._stop_scan()
+        for entry in self.scan_workspace_frame.children.values():
+            self._update_estimate(entry)
+
+    def _on_scan_point(self, record):
+        """Called after each point of scanning.
+
+        Record logged quantities in |history| and process pending GUI events
+        so |scan_stop_btn| stays responsive.
+        """
+        for device_name, quantities in record["quantities"].items():
+            for quantity, value in quantities.items():
+                self.history.record(device_name, quantity, value)
+        definition = self.scan_queue.current
         for entry in self.scan_workspace_frame.children.values():
-            entry.update_state()
+            if definition and entry.device == definition.device and \
+                    entry.attr == definition.attr:
+                entry.set_estimate("ETA %s, %d points left" %
+                                   (format_duration(record["eta"]),
+                                    record["remaining"]))
+        self.scan_queue_btn.config(text="Queue (%d)" % len(self.scan_queue))
+        self.update()
+
+    def _stop_scan(self):
+        """Stop scanning. Pending scans in |scan_queue| are dropped."""
+        self.scan_queue.stop()
+        self.scan_queue_btn.config(text="Queue (0)")
+        if self.scan_queue.is_running:
+            # Widgets are enabled when |scan_queue.run| returns.
+            return
+        self._set_scanning(False)
+
+    def _set_scanning(self, is_scanning):
+        """Disable widgets during scanning to prevent value change, or enable
+        them after scanning.
+
+        Device widgets are changed through |device_panel|, so only built
+        widgets are reconfigured.
+
+        """
+        state = not is_scanning
+        self.change_state(self.scan_frame, state)
+        self.change_state(self.device_picker, state)
+        self.change_state(self.add_device_btn, state)
+        self.device_panel.set_state(state)
+        if is_scanning:
+            self.change_state(self.scan_stop_btn, True)
+        else:
+            for entry in self.scan_workspace_frame.children.values():
+                entry.update_state()
 
     @staticmethod
     def _update_menu(menu, variable, choices):
@@ -443,12 +812,42 @@ class Application(tk.Frame):
             if _wid.widgetName == "label":
                 _wid.config(**label_cfg)
             elif _wid.widgetName in ["button", "checkbutton", "entry",
-                                     "menubutton"]:
+                                     "listbox", "menubutton"]:
                 _wid.config(**cfg)
 
 
+def main():
+    """Run the GUI, attached to the scan engine daemon if asked."""
+    parser = argparse.ArgumentParser(description="Control System GUI.")
+    parser.add_argument("--daemon", nargs="?", const=remote.SOCKET_PATH,
+                        metavar="SOCKET",
+                        help="attach to the scan engine daemon listening on "
+                             "SOCKET, default %s" % remote.SOCKET_PATH)
+    parser.add_argument("--frame-cache-mb", type=int, default=512,
+                        help="memory budget of recent camera frames in MB")
+    parser.add_argument("--history-mb", type=int,
+                        default=history.DEFAULT_MAX_BYTES // 2 ** 20,
+                        help="memory budget of the attribute history in MB")
+    parser.add_argument("--poll-interval", type=float, default=0.1,
+                        help="seconds between reads of the visible devices "
+                             "into the attribute history")
+    args = parser.parse_args()
+    client = None
+    if args.daemon:
+        try:
+            client = remote.DaemonClient(args.daemon)
+        except socket.error as err:
+            print "Error: no daemon on %s: %s" % (args.daemon, err)
+            sys.exit(1)
+
+    root = tk.Tk()
+    app = Application(master=root, client=client,
+                      frame_cache_bytes=args.frame_cache_mb * 2 ** 20,
+                      history_bytes=args.history_mb * 2 ** 20,
+                      poll_interval=args.poll_interval)
+    app.mainloop()
+    root.destroy()
+
+
 if __name__ == "__main__":
-    ROOT = tk.Tk()
-    APP = Application(master=ROOT)
-    APP.mainloop()
-    ROOT.destroy()
+    main()
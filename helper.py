@@ -14,3 +14,12 @@ def is_number(string):
         return float(string)
     except ValueError:
         return None
+
+def format_duration(seconds):
+    """Return |seconds| as a short text, eg. 1 h 05 min or 3 min 20 s."""
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return "%d h %02d min" % (seconds // 3600, seconds % 3600 // 60)
+    if seconds >= 60:
+        return "%d min %02d s" % (seconds // 60, seconds % 60)
+    return "%d s" % seconds
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+"""This module contains the attribute history of devices.
+
+Values of device attributes are kept in ring buffers, which grow as samples
+are added up to a maximum size, within a memory budget shared by all
+attributes. So memory stays bounded however long the application runs and
+however many devices are added. They are fed by |Poller| between scans and
+by the quantities logged at each scan point during scans.
+
+"""
+
+import threading
+import time
+
+import numpy as np
+
+import asyncdevice
+
+# One day of samples at 10 Hz.
+DEFAULT_SIZE = 24 * 3600 * 10
+# Memory budget of all attributes.
+DEFAULT_MAX_BYTES = 256 * 2 ** 20
+# Bytes per sample, timestamp and value.
+SAMPLE_BYTES = 16
+# Number of samples allocated by a new buffer.
+INITIAL_SIZE = 1024
+
+
+class RingBuffer(object):
+    """Buffer of (timestamp, value) samples. It doubles when full up to
+    |size| samples, then the oldest samples are overwritten.
+
+    Args:
+        size (int): maximum number of samples.
+        reserve (callable): called with the number of bytes needed to grow.
+                If it returns False, the buffer stops growing and overwrites
+                its oldest samples from then on.
+
+    """
+    def __init__(self, size=DEFAULT_SIZE, reserve=None):
+        self.size = size
+        self._reserve = reserve or (lambda nbytes: True)
+        self._times = np.zeros(min(size, INITIAL_SIZE))
+        self._values = np.zeros(min(size, INITIAL_SIZE))
+        self._count = 0
+        self._is_capped = False
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        """Bytes allocated for samples."""
+        return len(self._times) * SAMPLE_BYTES
+
+    def __len__(self):
+        return min(self._count, len(self._times))
+
+    def append(self, timestamp, value):
+        """Add sample |value| at |timestamp|. A timestamp earlier than the
+        last one is raised to it, so samples stay in time order."""
+        with self._lock:
+            if self._count:
+                last = self._times[(self._count - 1) % len(self._times)]
+                timestamp = max(timestamp, last)
+            if self._count == len(self._times):
+                self._grow()
+            idx = self._count % len(self._times)
+            self._times[idx] = timestamp
+            self._values[idx] = value
+            self._count += 1
+
+    def _grow(self):
+        """Double the buffer if allowed. Called with |_lock| held when
+        the buffer is full for the first time at its size."""
+        capacity = len(self._times)
+        if self._is_capped or capacity >= self.size:
+            return
+        extra = min(self.size, 2 * capacity) - capacity
+        if not self._reserve(extra * SAMPLE_BYTES):
+            self._is_capped = True
+            return
+        self._times = np.concatenate((self._times, np.zeros(extra)))
+        self._values = np.concatenate((self._values, np.zeros(extra)))
+
+    def get(self, start=None):
+        """Return (timestamps, values) arrays of samples from |start| in
+        time order, or all samples if |start| is None."""
+        with self._lock:
+            size = len(self._times)
+            if self._count <= size:
+                times = self._times[:self._count].copy()
+                values = self._values[:self._count].copy()
+            else:
+                idx = self._count % size
+                times = np.concatenate((self._times[idx:], self._times[:idx]))
+                values = np.concatenate((self._values[idx:],
+                                         self._values[:idx]))
+        if start is not None:
+            first = np.searchsorted(times, start)
+            times, values = times[first:], values[first:]
+        return times, values
+
+
+class History(object):
+    """Ring buffers of all recorded device attributes.
+
+    Args:
+        size (int): maximum number of samples per attribute.
+        max_bytes (int): memory budget of all attributes. When it is used
+                up, buffers stop growing and new attributes are not recorded.
+
+    Attributes:
+        nbytes (int): bytes allocated by all buffers.
+
+    """
+    def __init__(self, size=DEFAULT_SIZE, max_bytes=DEFAULT_MAX_BYTES):
+        self.size = size
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def _reserve(self, nbytes):
+        """Account |nbytes| more if within |max_bytes|. Return whether
+        accounted."""
+        with self._lock:
+            if self.nbytes + nbytes > self.max_bytes:
+                return False
+            self.nbytes += nbytes
+            return True
+
+    def record(self, device, attr, value):
+        """Add |value| of |device|::|attr| at the current time. Values which
+        are not numbers are ignored."""
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return
+        with self._lock:
+            buf = self._buffers.get((device, attr))
+            if buf is None:
+                buf = RingBuffer(self.size, self._reserve)
+                if self.nbytes + buf.nbytes > self.max_bytes:
+                    return
+                self._buffers[(device, attr)] = buf
+                self.nbytes += buf.nbytes
+        buf.append(time.time(), value)
+
+    def remove(self, device):
+        """Drop the recorded attributes of |device|."""
+        with self._lock:
+            for key in [key for key in self._buffers if key[0] == device]:
+                self.nbytes -= self._buffers.pop(key).nbytes
+
+    def keys(self):
+        """Return sorted list of recorded (device, attr)."""
+        with self._lock:
+            return sorted(self._buffers)
+
+    def get(self, device, attr, start=None):
+        """Return (timestamps, values) of |device|::|attr| from |start|."""
+        with self._lock:
+            buf = self._buffers.get((device, attr))
+        if buf is None:
+            return np.zeros(0), np.zeros(0)
+        return buf.get(start)
+
+
+def decimate(times, values, width):
+    """Return (timestamps, values) reduced to the minimum and maximum of
+    |width| equal time buckets, so a plot |width| pixels wide keeps every
+    spike of the full data.
+
+    Args:
+        times (numpy.ndarray): increasing timestamps.
+        values (numpy.ndarray): values at |times|.
+        width (int): number of buckets.
+
+    """
+    if len(times) <= 2 * width:
+        return times, values
+    edges = np.linspace(times[0], times[-1], width + 1)[:-1]
+    # First sample of each non-empty bucket.
+    starts = np.unique(np.searchsorted(times, edges))
+    mins = np.minimum.reduceat(values, starts)
+    maxs = np.maximum.reduceat(values, starts)
+    out_times = np.repeat(times[starts], 2)
+    out_values = np.empty(2 * len(starts))
+    out_values[0::2] = mins
+    out_values[1::2] = maxs
+    return out_times, out_values
+
+
+class Poller(threading.Thread):
+    """Thread reading the common attributes of devices into |history|.
+
+    Args:
+        history (History): where values are recorded.
+        get_models (callable): return list of |model.DeviceModel| to be read.
+        interval (float): seconds between reads of visible devices.
+        is_paused (callable): return True while devices must not be read,
+                eg. during scans, whose logged quantities are recorded
+                instead.
+        is_visible (callable): return whether a device is shown. Default is
+                all devices.
+        hidden_interval (float): seconds between reads of the other devices,
+                so hundreds of added devices do not load the control system.
+
+    """
+    def __init__(self, history, get_models, interval=0.1, is_paused=None,
+                 is_visible=None, hidden_interval=5.0):
+        threading.Thread.__init__(self, name="Poller")
+        self.daemon = True
+        self.history = history
+        self.get_models = get_models
+        self.interval = interval
+        self.is_paused = is_paused or (lambda: False)
+        self.is_visible = is_visible or (lambda device: True)
+        self.hidden_interval = hidden_interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        # Device name -> time of its last read.
+        last_reads = {}
+        while not self._stopped.is_set():
+            started = time.time()
+            if self.is_paused():
+                self._stopped.wait(self.interval)
+                continue
+            devices = [device for device in self.get_models()
+                       if self.is_visible(device) or started -
+                       last_reads.get(device.device_name, 0.0) >=
+                       self.hidden_interval]
+            for device in devices:
+                last_reads[device.device_name] = started
+            reads = [(device.device_name, attr,
+                      device.get_attribute_async(attr))
+                     for device in devices
+                     for attr in device.common_attr]
+            # Read all devices at once, unreachable devices are skipped.
+            results = asyncdevice.gather([read[2] for read in reads],
+                                         return_exceptions=True)
+            for (device_name, attr, _), value in zip(reads, results):
+                if not isinstance(value, Exception):
+                    self.history.record(device_name, attr, value)
+            self._stopped.wait(max(0, self.interval -
+                                   (time.time() - started)))
+
+    def stop(self):
+        """Stop reading."""
+        self._stopped.set()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""This module contains the crash-safe scan journal.
+
+The journal is a file in the scan folder. Its first line describes the scan,
+each following line records a completed point. All lines are JSON objects.
+
+    {"scan_id": "...", "definition": {...}}
+    {"point": 0, "value": 0.0, "offset": 120, "state": {...}}
+
+A point is recorded only after its log has been flushed, and |offset| is the
+size of the scan log at the end of the point. A scan is resumed by truncating
+the log to the last offset and continuing from the next point.
+
+"""
+
+import json
+import os
+
+FILE_NAME = "journal"
+
+
+class ScanJournal(object):
+    """Writer of the scan journal.
+
+    Args:
+        folder_path (str): scan folder, ends with "/".
+        records (list of dict): header followed by points already completed.
+                The journal is replaced atomically with |records|, which also
+                drops a torn last line when a scan is resumed.
+
+    """
+    def __init__(self, folder_path, records):
+        self.path = folder_path + FILE_NAME
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as tmp_file:
+            tmp_file.write("".join(json.dumps(record) + "\n"
+                                   for record in records))
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.rename(tmp_path, self.path)
+        self._file = open(self.path, "a")
+
+    def commit(self, records, fsync=False):
+        """Append |records| and flush them.
+
+        Args:
+            records (list of dict): records to be written.
+            fsync (bool): whether to fsync after flush.
+
+        """
+        self._file.write("".join(json.dumps(record) + "\n"
+                                 for record in records))
+        self._file.flush()
+        if fsync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        """Close the journal file."""
+        self._file.close()
+
+
+def load(folder_path):
+    """Return header and point records of the journal in |folder_path|.
+
+    A torn last line, left by a crash while writing, is ignored.
+
+    Args:
+        folder_path (str): scan folder, ends with "/".
+
+    """
+    with open(folder_path + FILE_NAME) as journal_file:
+        lines = journal_file.read().splitlines()
+    records = []
+    for line in lines:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            break
+    if not records:
+        raise IOError("Empty scan journal in %s." % folder_path)
+    return records[0], records[1:]
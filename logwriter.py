@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# pylint: disable=too-few-public-methods, too-many-instance-attributes
+"""This module contains the buffered asynchronous scan log writer.
+
+Devices write their logs to a |LogWriter| as if it were a file. Records are
+put into a bounded queue and written by a dedicated thread, so scan timing
+does not depend on file system latency.
+
+"""
+
+import os
+import threading
+import time
+import Queue
+
+
+class FlushPolicy(object):
+    """When |LogWriter| flushes written records to the file system.
+
+    Args:
+        mode (str): one of |EVERY_POINT|, |EVERY_N_POINTS| and
+                |EVERY_T_SECONDS|.
+        value (float): N for |EVERY_N_POINTS|, T for |EVERY_T_SECONDS|.
+                Must be positive.
+        fsync (bool): whether to fsync after each flush.
+
+    """
+    EVERY_POINT = "point"
+    EVERY_N_POINTS = "points"
+    EVERY_T_SECONDS = "seconds"
+
+    def __init__(self, mode=EVERY_POINT, value=1, fsync=False):
+        if mode not in (self.EVERY_POINT, self.EVERY_N_POINTS,
+                        self.EVERY_T_SECONDS):
+            raise ValueError("Unknown flush policy %s." % mode)
+        if not isinstance(value, (int, long, float)) or value <= 0:
+            raise ValueError("Illegal flush policy value %s." % (value,))
+        self.mode = mode
+        self.value = value
+        self.fsync = fsync
+
+    def __str__(self):
+        if self.mode == self.EVERY_POINT:
+            text = "every point"
+        elif self.mode == self.EVERY_N_POINTS:
+            text = "every %d points" % self.value
+        else:
+            text = "every %g seconds" % self.value
+        return text + (" with fsync" if self.fsync else "")
+
+
+class LogWriter(object):
+    """File-like log writer backed by a dedicated thread.
+
+    Args:
+        path (str): path of the log file.
+        policy (FlushPolicy): when to flush.
+        max_records (int): size of the record queue. |write| blocks when the
+                queue is full.
+        mode (str): mode in which the log file is opened.
+        journal (journal.ScanJournal): where point records are committed once
+                the log of the point is flushed, or None.
+
+    Attributes:
+        name (str): path of the log file, as for file objects.
+        policy (FlushPolicy): when to flush.
+        stats (dict): backpressure metrics, see |_new_stats|.
+
+    """
+    # Record kinds.
+    _DATA, _POINT, _CLOSE = range(3)
+    # Maximum records written at once.
+    _BATCH_SIZE = 256
+
+    def __init__(self, path, policy=None, max_records=1024, mode="w",
+                 journal=None):
+        self.name = path
+        self.policy = policy or FlushPolicy()
+        self.stats = self._new_stats()
+        self._journal = journal
+        self._file = open(path, mode)
+        self._file.seek(0, os.SEEK_END)
+        self._queue = Queue.Queue(max_records)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="LogWriter")
+        self._thread.daemon = True
+        self._thread.start()
+
+    @staticmethod
+    def _new_stats():
+        """Return initial backpressure metrics.
+
+        Keys:
+            records: number of records put.
+            points: number of points ended.
+            batches: number of batches written.
+            flushes: number of flushes.
+            max_depth: highest queue depth seen by |write|.
+            blocked_puts: number of puts which waited for a full queue.
+            blocked_time: total seconds spent waiting for a full queue.
+
+        """
+        return {"records": 0, "points": 0, "batches": 0, "flushes": 0,
+                "max_depth": 0, "blocked_puts": 0, "blocked_time": 0.0}
+
+    def _put(self, record):
+        """Put |record| into the queue, recording backpressure."""
+        if self._error:
+            raise IOError("Log writer failed: %s" % self._error)
+        self.stats["records"] += 1
+        depth = min(self._queue.qsize() + 1, self._queue.maxsize)
+        self.stats["max_depth"] = max(self.stats["max_depth"], depth)
+        try:
+            self._queue.put_nowait(record)
+        except Queue.Full:
+            begin = time.time()
+            self._queue.put(record)
+            self.stats["blocked_puts"] += 1
+            self.stats["blocked_time"] += time.time() - begin
+
+    def write(self, content):
+        """Queue |content| to be written."""
+        self._put((self._DATA, content))
+
+    def end_point(self, record=None):
+        """Mark the end of a scan point. Used by the flush policy.
+
+        Args:
+            record (dict): journal record of the point. Its "offset" is set to
+                    the size of the log at the end of the point.
+
+        """
+        self.stats["points"] += 1
+        self._put((self._POINT, record))
+
+    def close(self):
+        """Flush all queued records and close the file."""
+        if self._thread.is_alive():
+            self._queue.put((self._CLOSE, None))
+            self._thread.join()
+        if self._error:
+            raise IOError("Log writer failed: %s" % self._error)
+
+    def _flush(self, records):
+        """Flush the file according to |policy|, then commit journal
+        |records| of the flushed points."""
+        self._file.flush()
+        if self.policy.fsync:
+            os.fsync(self._file.fileno())
+        if records and self._journal:
+            self._journal.commit(records, self.policy.fsync)
+        self.stats["flushes"] += 1
+
+    def _run(self):
+        """Write records in batches until closed."""
+        policy = self.policy
+        timeout = policy.value \
+                if policy.mode == FlushPolicy.EVERY_T_SECONDS else None
+        last_flush = time.time()
+        offset = self._file.tell()
+        unflushed_points = 0
+        unflushed_records = []
+        is_dirty = False
+        is_closed = False
+        try:
+            while not is_closed:
+                try:
+                    batch = [self._queue.get(timeout=timeout)]
+                except Queue.Empty:
+                    batch = []
+                while len(batch) < self._BATCH_SIZE:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except Queue.Empty:
+                        break
+                contents = []
+                for kind, content in batch:
+                    if kind == self._DATA:
+                        contents.append(content)
+                        offset += len(content)
+                    elif kind == self._POINT:
+                        unflushed_points += 1
+                        if content is not None:
+                            content["offset"] = offset
+                            unflushed_records.append(content)
+                            is_dirty = True
+                    else:
+                        is_closed = True
+                if contents:
+                    self._file.write("".join(contents))
+                    self.stats["batches"] += 1
+                    is_dirty = True
+                if not is_dirty:
+                    continue
+                if policy.mode == FlushPolicy.EVERY_POINT:
+                    is_due = unflushed_points > 0
+                elif policy.mode == FlushPolicy.EVERY_N_POINTS:
+                    is_due = unflushed_points >= policy.value
+                else:
+                    is_due = time.time() - last_flush >= policy.value
+                if is_due or is_closed:
+                    self._flush(unflushed_records)
+                    last_flush = time.time()
+                    unflushed_points = 0
+                    unflushed_records = []
+                    is_dirty = False
+        except Exception as err: # pylint: disable=broad-except
+            self._error = err
+            # Keep consuming so that writers never block on a full queue.
+            while not is_closed:
+                is_closed = self._queue.get()[0] == self._CLOSE
+        finally:
+            self._file.close()
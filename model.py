@@ -0,0 +1,567 @@
+#!/usr/bin/env python
+# pylint: disable=bad-continuation, no-self-use, too-few-public-methods, too-many-instance-attributes, unused-argument
+"""This module contains device models for Control System.
+
+A device model holds the tango device proxy and the attribute values of a
+device. It does not depend on Tkinter, so devices which are not displayed
+are kept as models only, and scans can run without GUI.
+
+"""
+
+import os
+import time
+
+import asyncdevice
+import container
+import frame
+from helper import is_number
+
+
+class DeviceModel(object):
+    """Base class of device model.
+
+    Derived classes should follow the naming convention: TypeModel, eg.
+    MotorModel, and define their own attributes at initialization followed by
+    a call of _load().
+
+    Device I/O is implemented by the coroutines |get_attribute_async|,
+    |set_attribute_async| and |log_async| (see asyncdevice), so the I/O of
+    many devices can be in flight at once. |get_attribute|, |set_attribute|
+    and |log| run them to completion.
+
+    Args:
+        tango (gui.Tango): tango control system interface.
+        name (str): device name.
+
+    Attributes:
+        device_type (str): type of device, eg. Camera. Also the prefix of the
+                widget class, eg. widget.CameraDevice.
+        device_name (str): name of device, eg. cfeld/limaccds/poingrey.
+        tango_device: instance of tango device proxy, or None when the
+                device I/O goes through the daemon, see |remote|.
+        is_always_log (bool): whether record device info when scanning.
+        is_expert (bool): whether other attributes are displayed.
+        common_attr (list of str): common attributes.
+        scannable_attr (list of str): attributes which can be scanned.
+        other_attr (list of str):
+                other attributes which are displayed only in expert mode.
+        quantities (list of str): numeric quantities returned by |log|.
+        values (dict): attribute name -> value string shown in the widget.
+        timings (list of tuple): (phase, size, seconds) of the last |log|,
+                see |get_log_costs|.
+
+    """
+    def __init__(self, tango, name):
+        self.tango = tango
+        self.device_type = "DeviceBase"
+        self.device_name = name
+        self.tango_device = tango.get_device_proxy(name)
+        self.is_always_log = False
+        self.is_expert = False
+        self.common_attr = []
+        self.scannable_attr = []
+        self.other_attr = []
+        self.quantities = []
+        self.values = {}
+        self.timings = []
+
+    def _load(self):
+        """Read initial value of all attributes into |values|."""
+        for attr in self.common_attr + self.other_attr:
+            self.values[attr] = str(self.get_attribute(attr))
+
+    def _get_attribute(self, attr):
+        """Return value of |attribute| via tango device proxy.
+
+        Args:
+            attr(str): attribute.
+
+        """
+        return self.tango_device.read_attribute(attr).value
+
+    def _set_attribute(self, attr, val):
+        """Set value to attribute via tango device proxy.
+
+        Args:
+            attr(str): attribute.
+            val: value.
+
+        """
+        self.tango_device.write_attribute(attr, val)
+
+    def log(self, out):
+        """Log essential information. Called at each step of scanning if
+        |is_always_log| is True or it is the device to be scanned. Return dict
+        of logged |quantities|.
+
+        Args:
+            out (file object): where log is written.
+
+        """
+        return asyncdevice.run(self.log_async(out))
+
+    def log_async(self, out):
+        """Coroutine of |log|. Log is written to |out| at once when done.
+
+        Args:
+            out (file object): where log is written.
+
+        """
+        out.write("%s::%s::DefaultLog\n" % (self.device_type, self.device_name))
+        self.timings = [("log", 0.0, 0.0)]
+        raise asyncdevice.Return({})
+        yield
+
+    def get_log_costs(self, values):
+        """Return list of (phase, size) of |log| with attribute |values|.
+        Phases match |timings|, and the time of a phase is estimated as
+        linear in its size.
+
+        Args:
+            values (dict): attribute name -> value during the log. Missing
+                    attributes take their value in |values| of the model.
+
+        """
+        return [("log", 0.0)]
+
+    def _get_value(self, values, attr):
+        """Return number value of |attr| in |values|, or in |self.values|
+        if missing. Return 0.0 if not a number."""
+        if attr in values:
+            return values[attr]
+        return is_number(self.values.get(attr, "")) or 0.0
+
+    def get_attribute(self, attr):
+        """Get attribute value.
+
+        Args:
+            attr(str): attribute.
+
+        """
+        return asyncdevice.run(self.get_attribute_async(attr))
+
+    def get_attribute_async(self, attr):
+        """Coroutine of |get_attribute|. Should take care of all attributes in
+        |common_attr|, |scannable_attr| and |other_attr|.
+
+        Args:
+            attr(str): attribute.
+
+        """
+        yield
+
+    def get_state(self):
+        """Return dict of client-side state which changes during scanning.
+        Recorded in the scan journal after each point."""
+        return {}
+
+    def get_move(self, attr, val):
+        """Return (motor alias, position) if setting |attr| to |val| is a
+        motor move, otherwise None. Moves of several motors are batched into
+        a single mv macro.
+
+        Args:
+            attr(str): attribute.
+            val: value.
+
+        """
+        return None
+
+    def set_state(self, state):
+        """Restore |state| returned by |get_state| when a scan is resumed."""
+        pass
+
+    def set_attribute(self, attr, val):
+        """Set attribute value. Return False if failed.
+
+        Args:
+            attr(str): attribute.
+            val: value.
+
+        """
+        return asyncdevice.run(self.set_attribute_async(attr, val))
+
+    def set_attribute_async(self, attr, val):
+        """Coroutine of |set_attribute|. Should take care of all attributes in
+        |common_attr|, |scannable_attr| and |other_attr|. Return False if
+        failed.
+
+        Args:
+            attr(str): attribute.
+            val: value.
+
+        """
+        raise asyncdevice.Return(False)
+        yield
+
+    def validate_attribute(self, attr, val):
+        """Check attribute value without setting it. Return error message if
+        |val| is illegal, otherwise None. Called before a queued scan starts.
+
+        Args:
+            attr(str): attribute.
+            val: value.
+
+        """
+        if val is None:
+            return "Not a number."
+        return None
+
+
+class LimaCCDsModel(DeviceModel):
+    """Device model of Camera.
+
+    Common attributes:
+        - Exposure time
+
+    Other attributes:
+        - Number of frames
+
+    Quantities:
+        - Exposure Time
+        - Frame mean: mean intensity of the frames of a point.
+        - Frame sum: total intensity of the frames of a point.
+
+    Attributes:
+        reductions (set of str): frame reductions computed at each point, eg.
+                the quantity monitored by an adaptive scan.
+        is_preview (bool): whether the live preview is shown.
+        frame_cache (framecache.FrameCache): where frames are cached when
+                logged, keyed by (scan id, device name, frame number in the
+                container), or None.
+        start_time (float): timestamp of the start of the last acquisition,
+                or None.
+
+    """
+    def __init__(self, tango, name):
+        DeviceModel.__init__(self, tango, name)
+
+        self.device_type = "LimaCCDs"
+        self.is_always_log = True
+        self.common_attr = ["Exposure Time"]
+        self.scannable_attr = self.common_attr
+        self.other_attr = ["Number of frames"]
+        self.quantities = ["Exposure Time", "Frame mean", "Frame sum"]
+        self.reductions = set()
+        self.is_preview = False
+        self.frame_cache = None
+        self.start_time = None
+        # Frame container of the current scan, see |close_frames|.
+        self._frame_writer = None
+        # Proxy of |read_latest_frame|.
+        self._preview_device = None
+        # Number of frames and timestamps of the prepared acquisition.
+        self._nb_frames = 0
+        self._prepare_started = 0.0
+        self._prepared = 0.0
+
+        self._load()
+
+    def log_async(self, out):
+        """Coroutine of |log|. Called at each step of scanning if
+        |is_always_log| is True or it is the device to be scanned. Cameras
+        logged together are run phase by phase by |acquisition.log|
+        instead, so they start at once.
+
+        Args:
+            out (file object): where log is written.
+
+        """
+        yield self.prepare_async()
+        self.start_acquisition()
+        raise asyncdevice.Return((yield self.finish_async(out)))
+
+    def prepare_async(self):
+        """Coroutine preparing the acquisition of a scan point."""
+        device = self.tango_device
+        self._prepare_started = time.time()
+        self._nb_frames = (yield asyncdevice.read(device,
+                                                  "acq_nb_frames")).value
+        # Prevent acquisition not finished error.
+        while (yield asyncdevice.read(device, "acq_status")).value == \
+                "Running":
+            yield asyncdevice.Sleep(0.01)
+        yield asyncdevice.command(device, "prepareAcq")
+        self._prepared = time.time()
+
+    def read_latest_frame(self):
+        """Return the latest frame of the camera as 2-D numpy array, or None
+        if no frame was acquired. Read by a proxy of its own, so previews do
+        not wait for calls of the scan."""
+        if self._preview_device is None:
+            self._preview_device = self.tango.get_device_proxy(
+                    self.device_name)
+        image_idx = self._preview_device.last_image_ready
+        if image_idx < 0:
+            return None
+        return frame.read_frame(self._preview_device, image_idx)
+
+    def close_frames(self):
+        """Wait until the frames queued by |finish_async| are appended and
+        close the frame container. Raise IOError if frames could not be
+        written. Called at the end of a scan."""
+        writer, self._frame_writer = self._frame_writer, None
+        if writer:
+            writer.close()
+
+    def start_acquisition(self):
+        """Start the acquisition prepared by |prepare_async|. Block until
+        the camera has started. Return |start_time|, the middle of the
+        startAcq call."""
+        sent = time.time()
+        self.tango_device.startAcq()
+        self.start_time = (sent + time.time()) / 2
+        return self.start_time
+
+    def finish_async(self, out):
+        """Coroutine waiting for the acquisition started by
+        |start_acquisition| and logging its frames. Return dict of
+        quantities.
+
+        Args:
+            out (file object): where log is written.
+
+        Log:
+            captured images queued to the frame container of the device in
+            the folder of |out|, which is kept open until |close_frames|, see
+            |container.BackgroundFrameWriter|.
+            LimaCCDs::DeviceName::Exposure Time = 1.0
+            LimaCCDs::DeviceName::Start time = 1500000000.123456
+            LimaCCDs::DeviceName::Image = 1280 1024 Bpp16 (width, height,
+                    Lima image type of the frames)
+            LimaCCDs::DeviceName::Frame0 = CS_dev_name.frames#12 (container
+                    file name and frame number)
+            LimaCCDs::DeviceName::Frame mean = 12.5 (if in |reductions|)
+
+        """
+        device = self.tango_device
+        nb_frames = self._nb_frames
+        # Wait for capturing finish.
+        while (yield asyncdevice.read(device, "last_image_ready")).value != \
+                nb_frames - 1:
+            yield asyncdevice.Sleep(0.05)
+        acquired = time.time()
+        replies = yield [
+                asyncdevice.read(device, "acq_expo_time"),
+                asyncdevice.read(device, "image_width"),
+                asyncdevice.read(device, "image_height"),
+                asyncdevice.read(device, "image_type")]
+        expo = replies[0].value
+        content = "%s::%s::Exposure Time = %s\n" % \
+                (self.device_type, self.device_name, str(expo))
+        content += "%s::%s::Start time = %.6f\n" % \
+                (self.device_type, self.device_name, self.start_time)
+        content += "%s::%s::Image = %s %s %s\n" % \
+                (self.device_type, self.device_name, replies[1].value,
+                 replies[2].value, replies[3].value)
+        replies = yield [asyncdevice.command(device, "readImage", image_idx)
+                         for image_idx in range(nb_frames)]
+        images = [frame.decode_image(reply) for reply in replies]
+        # The log is named after the scan id.
+        scan_id = os.path.splitext(os.path.basename(out.name))[0]
+        path = container.frame_path(os.path.dirname(out.name) + "/", scan_id,
+                                    self.device_name)
+        if self._frame_writer and self._frame_writer.path != path:
+            self.close_frames()
+        if not self._frame_writer:
+            self._frame_writer = container.BackgroundFrameWriter(path)
+        for image_idx, image in enumerate(images):
+            number = self._frame_writer.append(image)
+            content += "%s::%s::Frame%d = %s#%d\n" % \
+                    (self.device_type, self.device_name, image_idx,
+                     os.path.basename(path), number)
+            if self.frame_cache is not None:
+                self.frame_cache.put((scan_id, self.device_name, number),
+                                     image)
+        quantities = {"Exposure Time": expo}
+        if self.reductions:
+            sums = [float(image.sum()) for image in images]
+            size = images[0].size
+            quantities["Frame sum"] = sum(sums)
+            quantities["Frame mean"] = sum(sums) / (size * nb_frames)
+            for quantity in sorted(self.reductions):
+                content += "%s::%s::%s = %s\n" % (self.device_type,
+                                                  self.device_name, quantity,
+                                                  quantities[quantity])
+        out.write(content)
+        self.timings = [("prepare", 0.0,
+                         self._prepared - self._prepare_started),
+                        ("acquire", expo * nb_frames,
+                         acquired - self.start_time),
+                        ("save", nb_frames, time.time() - acquired)]
+        raise asyncdevice.Return(quantities)
+
+    def get_log_costs(self, values):
+        """Return list of (phase, size) of |log| with attribute |values|.
+        Acquisition is linear in the total exposure time and saving in the
+        number of frames.
+
+        Args:
+            values (dict): attribute name -> value during the log.
+
+        """
+        expo = self._get_value(values, "Exposure Time")
+        nb_frames = self._get_value(values, "Number of frames")
+        return [("prepare", 0.0), ("acquire", expo * nb_frames),
+                ("save", nb_frames)]
+
+    def get_attribute_async(self, attr):
+        """Coroutine of |get_attribute|. Should take care of all attributes in
+        |common_attr|, |scannable_attr| and |other_attr|.
+
+        Args:
+            attr(str): attribute.
+
+        """
+        if attr == "Exposure Time":
+            reply = yield asyncdevice.read(self.tango_device, "acq_expo_time")
+            raise asyncdevice.Return(reply.value)
+        elif attr == "Number of frames":
+            reply = yield asyncdevice.read(self.tango_device, "acq_nb_frames")
+            raise asyncdevice.Return(reply.value)
+        else:
+            print "Error: unknown attribute %s." % attr
+            raise asyncdevice.Return(None)
+
+    def set_attribute_async(self, attr, val):
+        """Coroutine of |set_attribute|. Should take care of all attributes in
+        |common_attr|, |scannable_attr| and |other_attr|. Return False if
+        failed.
+
+        Args:
+            attr(str): attribute.
+            val: value.
+
+        """
+        if attr == "Exposure Time":
+            error = self.validate_attribute(attr, val)
+            if error:
+                print "Error: %s" % error
+                raise asyncdevice.Return(False)
+            yield asyncdevice.write(self.tango_device, "acq_expo_time", val)
+        elif attr == "Number of frames":
+            yield asyncdevice.write(self.tango_device, "acq_nb_frames", val)
+        else:
+            print "Error: unknown attribute %s." % attr
+            raise asyncdevice.Return(False)
+        raise asyncdevice.Return(True)
+
+    def validate_attribute(self, attr, val):
+        """Check attribute value without setting it. Return error message if
+        |val| is illegal, otherwise None.
+
+        Args:
+            attr(str): attribute.
+            val: value.
+
+        """
+        error = DeviceModel.validate_attribute(self, attr, val)
+        if error:
+            return error
+        if attr == "Exposure Time":
+            min_et, max_et = self._get_attribute("valid_ranges")[:2]
+            if val < min_et or val > max_et:
+                return "Illegal exposure time %s." % val
+        return None
+
+
+class MotorModel(DeviceModel):
+    """Device model of Motor.
+
+    Common attributes:
+        - Position
+
+    Other attributes:
+        - Step per unit
+
+    """
+    def __init__(self, tango, name):
+        DeviceModel.__init__(self, tango, name)
+
+        self.device_type = "Motor"
+        self.is_always_log = False
+        self.common_attr = ["Position"]
+        self.scannable_attr = self.common_attr
+        self.other_attr = ["Step per unit"]
+        self.quantities = ["Position"]
+
+        self._load()
+
+    def log_async(self, out):
+        """Coroutine of |log|. Called at each step of scanning if
+        |is_always_log| is True or it is the device to be scanned.
+
+        Args:
+            out (file object): where log is written.
+
+        Log:
+            Motor::DeviceName::Position = 0.0
+
+        """
+        started = time.time()
+        pos = (yield asyncdevice.read(self.tango_device, "position")).value
+        content = "%s::%s::Position = %s\n" % \
+                (self.device_type, self.device_name, str(pos))
+        out.write(content)
+        self.timings = [("log", 0.0, time.time() - started)]
+        raise asyncdevice.Return({"Position": pos})
+
+    def get_move(self, attr, val):
+        """Return (motor alias, position) if setting |attr| to |val| is a
+        motor move, otherwise None.
+
+        Args:
+            attr(str): attribute.
+            val: value.
+
+        """
+        if attr == "Position":
+            # Must use device alias.
+            return (self.tango.get_device_alias(self.device_name), val)
+        return None
+
+    def get_attribute_async(self, attr):
+        """Coroutine of |get_attribute|. Should take care of all attributes in
+        |common_attr|, |scannable_attr| and |other_attr|.
+
+        Args:
+            attr(str): attribute.
+
+        """
+        if attr == "Position":
+            reply = yield asyncdevice.read(self.tango_device, "position")
+            raise asyncdevice.Return(reply.value)
+        elif attr == "Step per unit":
+            reply = yield asyncdevice.read(self.tango_device, "step_per_unit")
+            raise asyncdevice.Return(reply.value)
+        else:
+            print "Error: unknown attribute %s." % attr
+            raise asyncdevice.Return(None)
+
+    def set_attribute_async(self, attr, val):
+        """Coroutine of |set_attribute|. Should take care of all attributes in
+        |common_attr|, |scannable_attr| and |other_attr|. Return False if
+        failed.
+
+        Args:
+            attr(str): attribute.
+            val: value.
+
+        """
+        if attr == "Position":
+            # Sardana macros are run on a door, which blocks until the motor
+            # stopped, so the move waits in a worker thread. Its door logs go
+            # to the sink of the calling thread, eg. the log of a scan.
+            sink = self.tango.get_log_sink()
+            try:
+                yield asyncdevice.call(self.tango.move,
+                                       [self.get_move(attr, val)], sink)
+            except Exception as err: # pylint: disable=broad-except
+                print "Error: failed to move %s: %s" % (self.device_name, err)
+                raise asyncdevice.Return(False)
+        elif attr == "Step per unit":
+            yield asyncdevice.write(self.tango_device, "step_per_unit", val)
+        else:
+            print "Error: unknown attribute %s." % attr
+            raise asyncdevice.Return(False)
+        raise asyncdevice.Return(True)
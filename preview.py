@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""This module contains the live preview of cameras.
+
+Frames are fetched and converted in background at a capped rate. Only the
+latest converted frame is kept, so a slow GUI drops frames instead of
+queueing stale ones, and the acquisition is never waited for. While a scan
+fills the frame cache, frames are taken from the cache instead of the
+camera.
+
+"""
+
+import base64
+import threading
+import time
+
+import PyTango
+
+import frame
+
+
+class FrameFetcher(threading.Thread):
+    """Thread fetching the latest frame of a LimaCCDs device.
+
+    Args:
+        model (model.LimaCCDsModel): model of the device, which reads its
+                latest frame.
+        width (int): maximum width of the preview in pixels.
+        height (int): maximum height of the preview in pixels.
+        max_fps (float): maximum number of frames fetched per second.
+        cache (framecache.FrameCache): frames logged by scans, or None.
+
+    Attributes:
+        error (str): last error of fetching, or None.
+
+    """
+    # Seconds after the last cached frame during which the camera is not
+    # read.
+    CACHE_HOLD = 2.0
+
+    def __init__(self, model, width, height, max_fps=5.0, cache=None):
+        threading.Thread.__init__(self, name="FrameFetcher")
+        self.daemon = True
+        self.model = model
+        self.device_name = model.device_name
+        self.width = width
+        self.height = height
+        self.max_fps = max_fps
+        self.cache = cache
+        self.error = None
+        self._latest = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def run(self):
+        cache_count, cache_time = 0, 0.0
+        while not self._stopped.is_set():
+            started = time.time()
+            image = None
+            if self.cache is not None:
+                count, cached = self.cache.get_latest(self.device_name)
+                if count != cache_count:
+                    cache_count, cache_time = count, started
+                    image = cached
+            try:
+                if image is None and \
+                        started - cache_time > self.CACHE_HOLD:
+                    image = self.model.read_latest_frame()
+                if image is not None:
+                    data = base64.b64encode(frame.to_pgm(image, self.width,
+                                                         self.height))
+                    with self._lock:
+                        # An untaken frame is dropped.
+                        self._latest = data
+                self.error = None
+            except (PyTango.DevFailed, RuntimeError, ValueError) as err:
+                self.error = str(err)
+            self._stopped.wait(max(0, 1.0 / self.max_fps -
+                                   (time.time() - started)))
+
+    def take(self):
+        """Return the latest frame as base64 PGM, or None if no new frame."""
+        with self._lock:
+            data, self._latest = self._latest, None
+        return data
+
+    def stop(self):
+        """Stop fetching."""
+        self._stopped.set()
@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+# pylint: disable=too-few-public-methods
+"""This module contains the client side of the scan engine daemon.
+
+|DaemonClient| speaks the protocol of |daemon|. |RemoteTango|,
+|RemoteScanQueue| and |RemoteFrameCache| stand in for |gui.Tango|,
+|scan.ScanQueue| and |framecache.FrameCache|, so the GUI can be attached to a
+running daemon: device attributes and frames are read and set by the daemon,
+which holds the only device proxies, and scans are queued and run there.
+Several GUIs can attach to the same daemon, and a running scan goes on when a
+GUI dies.
+
+"""
+
+import base64
+import json
+import os
+import socket
+import threading
+import uuid
+from collections import deque
+
+import numpy as np
+
+import asyncdevice
+import estimator
+import journal
+import logwriter
+import model
+import scan
+
+# Default path of the daemon socket.
+SOCKET_PATH = "/tmp/cfel-control.sock"
+
+
+def dumps(obj):
+    """Return |obj| as one line of JSON. NumPy scalars are converted to
+    Python numbers, other unknown objects to strings."""
+    return json.dumps(obj, default=lambda value: value.item()
+                      if hasattr(value, "item") else str(value)) + "\n"
+
+
+def encode_frame(image):
+    """Return numpy array |image| as a dict which can be sent as JSON, or
+    None if |image| is None."""
+    if image is None:
+        return None
+    return {"shape": image.shape, "dtype": image.dtype.str,
+            "data": base64.b64encode(np.ascontiguousarray(image).tostring())}
+
+
+def decode_frame(data):
+    """Return numpy array of |data| returned by |encode_frame|."""
+    if data is None:
+        return None
+    return np.frombuffer(base64.b64decode(data["data"]),
+                         dtype=data["dtype"]).reshape(data["shape"])
+
+
+class EventStream(object):
+    """Events of the daemon, received on a dedicated connection. Events
+    published after the stream is created are iterated, one dict each.
+
+    Args:
+        sock (socket.socket): new connection to the daemon.
+
+    """
+    def __init__(self, sock):
+        self._socket = sock
+        self._file = sock.makefile("rw")
+        self._file.write(dumps({"command": "subscribe"}))
+        self._file.flush()
+        self._file.readline()
+
+    def __iter__(self):
+        for line in iter(self._file.readline, ""):
+            yield json.loads(line)
+
+    def close(self):
+        """Close the connection."""
+        self._file.close()
+        self._socket.close()
+
+
+class DaemonClient(object):
+    """Client of the scan engine daemon. Requests may be sent from several
+    threads.
+
+    Args:
+        socket_path (str): path of the daemon socket.
+
+    """
+    def __init__(self, socket_path=SOCKET_PATH):
+        self.socket_path = socket_path
+        self._socket = self._connect()
+        self._file = self._socket.makefile("rw")
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """Return socket connected to the daemon."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+        return sock
+
+    def request(self, command, **args):
+        """Send |command| with |args| and return its result. Raise
+        RuntimeError if the daemon reports an error."""
+        args["command"] = command
+        with self._lock:
+            self._file.write(dumps(args))
+            self._file.flush()
+            line = self._file.readline()
+        if not line:
+            raise RuntimeError("Daemon disconnected.")
+        response = json.loads(line)
+        if not response["ok"]:
+            raise RuntimeError(response["error"])
+        return response["result"]
+
+    def events(self):
+        """Return |EventStream| of the daemon, eg. per-point records of
+        running scans."""
+        return EventStream(self._connect())
+
+    def close(self):
+        """Close the connection."""
+        self._file.close()
+        self._socket.close()
+
+
+class _RemoteDevice(object):
+    """Mixin routing the attribute I/O of a device model to the daemon.
+    Combined with a model class by |RemoteTango.create_model|."""
+    def get_attribute_async(self, attr):
+        """Coroutine of |get_attribute|, read by the daemon."""
+        raise asyncdevice.Return(self.tango.client.request(
+                "get_attribute", device=self.device_name, attr=attr))
+        yield
+
+    def set_attribute_async(self, attr, val):
+        """Coroutine of |set_attribute|, set by the daemon. Return False if
+        failed."""
+        try:
+            result = self.tango.client.request(
+                    "set_attribute", device=self.device_name, attr=attr,
+                    value=val)
+        except RuntimeError as err:
+            print "Error: %s" % err
+            result = False
+        raise asyncdevice.Return(result)
+        yield
+
+    def validate_attribute(self, attr, val):
+        """Check attribute value by the daemon. Return error message if
+        |val| is illegal, otherwise None."""
+        return self.tango.client.request(
+                "validate_attribute", device=self.device_name, attr=attr,
+                value=val)
+
+    def read_latest_frame(self):
+        """Return the latest frame of the camera read by the daemon, or None
+        if no frame was acquired."""
+        return decode_frame(self.tango.client.request(
+                "read_latest_frame", device=self.device_name))
+
+
+class RemoteTango(object):
+    """Tango interface of a GUI attached to the daemon.
+
+    Args:
+        client (DaemonClient): connection to the daemon.
+
+    Attributes:
+        client (DaemonClient): connection to the daemon.
+        devices (list of str): all devices found by the daemon.
+        aliases (dict): device name -> alias, for devices which have one.
+
+    """
+    def __init__(self, client):
+        self.client = client
+        self.devices = client.request("list_devices")
+        self.aliases = client.request("get_aliases")
+
+    def get_device_class(self, device):
+        """Return the tango class of |device|."""
+        return self.client.request("get_device_class", name=device)
+
+    @staticmethod
+    def get_device_proxy(device_name):
+        """Return None. The device I/O of models attached to the daemon goes
+        through the daemon, so they have no proxy."""
+        return None
+
+    def create_model(self, device_name):
+        """Add |device_name| to the daemon and return its device model,
+        whose attributes are read and set by the daemon."""
+        base = getattr(model, self.get_device_class(device_name) + "Model")
+        self.client.request("add_device", name=device_name)
+        remote_class = type("Remote" + base.__name__, (_RemoteDevice, base),
+                            {})
+        return remote_class(self, device_name)
+
+
+class RemoteFrameCache(object):
+    """Frame cache of the daemon, which holds the frames logged by its
+    cameras. Has the interface of |framecache.FrameCache| used by previews
+    and the frame browser.
+
+    Args:
+        client (DaemonClient): connection to the daemon.
+
+    """
+    def __init__(self, client):
+        self.client = client
+        # Device name -> number of frames put at the last |get_latest|.
+        self._counts = {}
+
+    def __len__(self):
+        return self.stats["frames"]
+
+    @property
+    def stats(self):
+        """Metrics of the cache of the daemon."""
+        return self.client.request("get_frame_cache")["stats"]
+
+    @property
+    def max_bytes(self):
+        """Maximum total size of the frames cached by the daemon."""
+        return self.client.request("get_frame_cache")["max_bytes"]
+
+    def keys(self):
+        """Return keys of cached frames, the least recently used first."""
+        return [tuple(key) for key in self.client.request("get_frame_keys")]
+
+    def get(self, key):
+        """Return frame of |key|, or None if not cached."""
+        return decode_frame(self.client.request("get_frame", key=key))
+
+    def get_latest(self, device):
+        """Return (number of frames put for |device|, last frame). The frame
+        is only sent when the number has changed since the last call, as
+        callers compare the number to detect new frames."""
+        reply = self.client.request("get_latest_frame", device=device,
+                                    count=self._counts.get(device))
+        self._counts[device] = reply["count"]
+        return reply["count"], decode_frame(reply["frame"])
+
+
+class RemoteScanQueue(object):
+    """Scan queue of a GUI attached to the daemon.
+
+    Scans are kept here until |run|, which sends them to the daemon and
+    reports its events until the daemon has run all queued scans.
+
+    Args:
+        client (DaemonClient): connection to the daemon.
+        log_path (str): where log folders are placed by the daemon.
+
+    Attributes:
+        log_path (str): where log folders are placed by the daemon.
+        is_running (bool): whether |run| is waiting for the daemon.
+        current (scan.ScanDefinition): scan run by the daemon, or None.
+        estimator (estimator.DurationEstimator): phase costs recorded by the
+                daemon, reloaded after each |run|.
+
+    """
+    def __init__(self, client, log_path):
+        self.client = client
+        self.log_path = log_path
+        self.is_running = False
+        self.current = None
+        self.estimator = estimator.DurationEstimator(log_path +
+                                                     "durations.json")
+        self._pending = deque()
+        # Scan id of |current|.
+        self._current_id = None
+        # Prefix of the tags of the scans sent to the daemon, so events of
+        # the scans of other clients are told apart.
+        self._tag_prefix = uuid.uuid4().hex
+        self._tag_count = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def append(self, definition):
+        """Queue |definition|."""
+        self._pending.append(definition)
+
+    def resume(self, folder_path):
+        """Put the interrupted scan in |folder_path| at the front of the
+        queue. Return its definition."""
+        folder_path = os.path.join(folder_path, "")
+        header = journal.load(folder_path)[0]
+        definition = scan.ScanDefinition.from_dict(header["definition"])
+        definition.resume_path = folder_path
+        self._pending.appendleft(definition)
+        return definition
+
+    @property
+    def flush_policy(self):
+        """Flush policy of the scan logs of the daemon."""
+        policy = self.client.request("get_state")["scan"]["flush_policy"]
+        return logwriter.FlushPolicy(policy["mode"], policy["value"],
+                                     policy["fsync"])
+
+    @flush_policy.setter
+    def flush_policy(self, policy):
+        self.client.request("set_flush_policy", mode=policy.mode,
+                            value=policy.value, fsync=policy.fsync)
+
+    @property
+    def log_stats(self):
+        """Backpressure metrics of the last scan log of the daemon."""
+        return self.client.request("get_state")["scan"]["log_stats"]
+
+    def stop(self):
+        """Drop queued scans, and stop the daemon if |run| is waiting for
+        it."""
+        self._pending.clear()
+        if self.is_running:
+            self.client.request("stop_scan")
+
+    def run(self, on_error=None, on_point=None):
+        """Send queued scans to the daemon and wait until it has run them.
+
+        Args:
+            on_error (callable): called with error messages.
+            on_point (callable): called with the record of each point, see
+                    |scan.ScanQueue.run|.
+
+        """
+        on_error = on_error or (lambda msg: None)
+        events = self.client.events()
+        self.is_running = True
+        try:
+            # Tags of the sent scans which are not done.
+            tags = set()
+            while self._pending:
+                definition = self._pending.popleft()
+                self._tag_count += 1
+                tag = "%s-%d" % (self._tag_prefix, self._tag_count)
+                try:
+                    if definition.resume_path:
+                        self.client.request("resume_scan",
+                                            folder=definition.resume_path,
+                                            tag=tag)
+                    else:
+                        self.client.request("start_scan",
+                                            definition=definition.to_dict(),
+                                            tag=tag)
+                    tags.add(tag)
+                except RuntimeError as err:
+                    on_error("%s: %s" % (definition, err))
+            for event in events if tags else []:
+                tag = event.get("tag")
+                if event["event"] == "point" and tag in tags:
+                    self._update_current(event["record"]["scan_id"])
+                    if on_point:
+                        on_point(event["record"])
+                elif event["event"] == "error" and (tag is None or
+                                                    tag in tags):
+                    on_error(event["message"])
+                elif event["event"] == "done":
+                    tags.discard(tag)
+                    if not tags:
+                        break
+        finally:
+            events.close()
+            self.is_running = False
+            self.current = None
+            self._current_id = None
+            self.estimator = estimator.DurationEstimator(self.estimator.path)
+
+    def _update_current(self, scan_id):
+        """Fetch |current| when the daemon starts scan |scan_id|."""
+        if scan_id == self._current_id:
+            return
+        current = self.client.request("get_state")["scan"]["current"]
+        self.current = current and scan.ScanDefinition.from_dict(current)
+        self._current_id = scan_id
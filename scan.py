@@ -0,0 +1,606 @@
+#!/usr/bin/env python
+# pylint: disable=bad-continuation, too-few-public-methods, too-many-arguments, too-many-instance-attributes
+"""This module contains the scan definition and the scan queue.
+
+The scan queue does not depend on Tkinter, so it can be driven by the GUI as
+well as by a headless runner.
+
+"""
+
+import datetime
+import math
+import os
+import threading
+import time
+from collections import deque
+
+import acquisition
+import asyncdevice
+import estimator
+import journal
+import logwriter
+
+
+def _print_error(message):
+    """Default error handler of |ScanQueue|."""
+    print "Error: %s" % message
+
+
+class ScanDefinition(object):
+    """Static description of a scan.
+
+    Args:
+        device (str): device to be scanned.
+        attr (str): attribute to be scanned.
+        start (float): start value of |attr|.
+        end (float): end value of |attr|.
+        step (float): step of |attr|. For adaptive scans, step of the coarse
+                pass.
+        static_values (list of tuple): (device, attr, value) to be set before
+                scanning.
+        logging_devices (list of str): devices to be logged at each point. The
+                scanned device comes first.
+        adaptive (dict): None for a fixed step scan. Otherwise parameters of
+                |AdaptivePlanner|: "monitor" (list of device and quantity),
+                "budget" (int) and "tolerance" (float).
+
+    Attributes:
+        resume_path (str): folder of an interrupted scan to be continued, or
+                None for a new scan.
+
+    """
+    def __init__(self, device, attr, start, end, step, static_values=None,
+                 logging_devices=None, adaptive=None):
+        self.device = device
+        self.attr = attr
+        self.start = start
+        self.end = end
+        self.step = step
+        self.static_values = static_values or []
+        self.logging_devices = logging_devices or [device]
+        self.adaptive = adaptive
+        self.resume_path = None
+
+    @classmethod
+    def from_dict(cls, data):
+        """Return definition from |data| created by |to_dict|."""
+        return cls(data["device"], data["attr"], data["start"], data["end"],
+                   data["step"],
+                   [tuple(value) for value in data["static_values"]],
+                   data["logging_devices"], data.get("adaptive"))
+
+    def to_dict(self):
+        """Return definition as dict which can be serialized to JSON."""
+        return {"device": self.device, "attr": self.attr,
+                "start": self.start, "end": self.end, "step": self.step,
+                "static_values": self.static_values,
+                "logging_devices": self.logging_devices,
+                "adaptive": self.adaptive}
+
+    def __str__(self):
+        return "%s::%s [%s, %s, %s]" % (self.device, self.attr, self.start,
+                                        self.end, self.step)
+
+    def points(self):
+        """Return list of values of the scanned attribute with fixed step."""
+        if self.step <= 0 or self.end < self.start:
+            return [self.start]
+        count = int((self.end - self.start) / self.step + 1e-9) + 1
+        return [self.start + idx * self.step for idx in range(count)]
+
+    def planner(self):
+        """Return a new planner choosing the points of the scan."""
+        if self.adaptive:
+            return AdaptivePlanner(self.points(), self.step,
+                                   self.adaptive["budget"],
+                                   self.adaptive["tolerance"])
+        return StepPlanner(self.points())
+
+
+class StepPlanner(object):
+    """Planner of a fixed step scan.
+
+    A planner is asked for the next value of the scanned attribute, and told
+    the value of the monitored quantity once the point is logged.
+
+    Args:
+        points (list of float): values of the scanned attribute.
+
+    """
+    def __init__(self, points):
+        self.points = points
+        self.count = 0
+
+    def ask(self):
+        """Return value of the next point, or None if the scan is done."""
+        if self.count >= len(self.points):
+            return None
+        return self.points[self.count]
+
+    def tell(self, value, result):
+        """Record |result| of the monitored quantity at |value|."""
+        self.count += 1
+
+    def remaining(self):
+        """Return the maximum number of points left."""
+        return len(self.points) - self.count
+
+
+class AdaptivePlanner(StepPlanner):
+    """Planner of an adaptive scan.
+
+    The coarse pass logs |points| in order. Then the interval with the largest
+    loss is split at its middle. The loss of an interval is its length on the
+    curve of the monitored quantity, with both axes normalised to their
+    range, so intervals where the quantity changes fastest are refined first
+    and flat regions are left alone.
+
+    Args:
+        points (list of float): values of the coarse pass.
+        step (float): step of the coarse pass. Intervals are not split below
+                |step| / 2 ** |MAX_DEPTH|.
+        budget (int): maximum number of points.
+        tolerance (float): the scan stops when no loss exceeds |tolerance|.
+
+    Points whose result is None, eg. the monitored quantity was not logged,
+    are not used to choose the next points, and are not measured again.
+
+    """
+    MAX_DEPTH = 6
+
+    def __init__(self, points, step, budget, tolerance):
+        # Values may be integers, eg. from JSON, which would be truncated
+        # when intervals are split.
+        StepPlanner.__init__(self, [float(point) for point in points])
+        self.budget = budget
+        self.tolerance = tolerance
+        self.min_width = float(step) / 2 ** self.MAX_DEPTH
+        # Value of scanned attribute -> result of monitored quantity.
+        self.results = {}
+        # Values of scanned attribute without result.
+        self.missing = set()
+
+    def ask(self):
+        """Return value of the next point, or None if the scan is done."""
+        if self.count >= self.budget:
+            return None
+        if self.count < len(self.points):
+            return self.points[self.count]
+        values = sorted(self.results)
+        if len(values) < 2:
+            return None
+        results = [self.results[value] for value in values]
+        x_range = (values[-1] - values[0]) or 1.0
+        y_range = (max(results) - min(results)) or 1.0
+        best_loss, best_value = self.tolerance, None
+        for idx in range(len(values) - 1):
+            width = values[idx + 1] - values[idx]
+            if width < 2 * self.min_width:
+                continue
+            middle = values[idx] + width / 2
+            if middle in self.missing:
+                continue
+            loss = math.hypot(width / x_range,
+                              (results[idx + 1] - results[idx]) / y_range)
+            if loss > best_loss:
+                best_loss, best_value = loss, middle
+        return best_value
+
+    def tell(self, value, result):
+        """Record |result| of the monitored quantity at |value|."""
+        StepPlanner.tell(self, value, result)
+        if result is not None:
+            self.results[float(value)] = float(result)
+        else:
+            self.missing.add(float(value))
+
+    def remaining(self):
+        """Return the maximum number of points left."""
+        return self.budget - self.count
+
+
+class _Stage(threading.Thread):
+    """Prepare a scan in background.
+
+    Creates the log folder, validates the static attribute values and applies
+    the static values of devices which are not used by the running scan.
+
+    Args:
+        queue (ScanQueue): owner of the stage.
+        definition (ScanDefinition): scan to be prepared.
+        busy_devices (list of str): devices used by the running scan.
+
+    Attributes:
+        scan_id (str): id of the scan, also the name of the log folder.
+        folder_path (str): path of the log folder, ends with "/".
+        completed (list of dict): journal records of points already done when
+                a scan is resumed.
+        errors (list of str): problems found during staging.
+        applied (set of tuple): (device, attr) already set.
+
+    """
+    def __init__(self, queue, definition, busy_devices=()):
+        threading.Thread.__init__(self, name="ScanStage")
+        self.daemon = True
+        self.queue = queue
+        self.definition = definition
+        self.busy_devices = set(busy_devices)
+        self.scan_id = None
+        self.folder_path = None
+        self.completed = []
+        self.errors = []
+        self.applied = set()
+
+    def run(self):
+        if self.definition.resume_path:
+            self.folder_path = self.definition.resume_path
+            try:
+                header, self.completed = journal.load(self.folder_path)
+            except IOError as err:
+                self.errors.append(str(err))
+                return
+            self.scan_id = header["scan_id"]
+        else:
+            self.scan_id, self.folder_path = self.queue.make_folder()
+        for device_name, attr, val in self.definition.static_values:
+            device = self.queue.get_device(device_name)
+            if device is None:
+                self.errors.append("Device %s not found." % device_name)
+                continue
+            error = device.validate_attribute(attr, val)
+            if error:
+                self.errors.append("Invalid value of %s::%s: %s" %
+                                   (device_name, attr, error))
+        if self.errors:
+            return
+        values = [value for value in self.definition.static_values
+                  if value[0] not in self.busy_devices]
+        if not values:
+            return
+        # Door logs of the staging macros go to the log of this scan.
+        door_file = self.queue.open_door_log(self.folder_path, self.scan_id)
+        try:
+            self.errors = self.queue.apply_values(values)
+        finally:
+            self.errors += self.queue.close_door_log(door_file)
+        self.applied = set(value[:2] for value in values)
+
+
+class ScanQueue(object):
+    """Queue of scans which are run back to back.
+
+    While the last point of a scan is being logged, the next scan is staged in
+    background by |_Stage|, so the idle time between queued scans is close to
+    zero.
+
+    Args:
+        get_device (callable): return device by name, or None if not found.
+                A device provides |validate_attribute|, |set_attribute|,
+                |get_move| and |log|.
+        log_path (str): where log folders are placed.
+        tango (gui.Tango): runs the moves of |get_move|.
+
+    Attributes:
+        is_running (bool): whether |run| is in progress.
+        current (ScanDefinition): scan being run, or None.
+        estimator (estimator.DurationEstimator): phase costs learned from the
+                scans, kept in durations.json under |log_path|.
+        flush_policy (logwriter.FlushPolicy): durability of scan logs.
+        log_stats (dict): backpressure metrics of the last scan log, see
+                |logwriter.LogWriter.stats|.
+
+    """
+    def __init__(self, get_device, log_path, tango=None):
+        self.get_device = get_device
+        self.log_path = log_path
+        self.tango = tango
+        self.is_running = False
+        self.current = None
+        self.estimator = estimator.DurationEstimator(log_path +
+                                                     "durations.json")
+        self.flush_policy = logwriter.FlushPolicy()
+        self.log_stats = None
+        self._pending = deque()
+        self._is_stopped = False
+        self._folder_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def append(self, definition):
+        """Append |definition| to the end of the queue."""
+        self._pending.append(definition)
+
+    def clear(self):
+        """Remove all pending scans."""
+        self._pending.clear()
+
+    def stop(self):
+        """Stop the running scan after the current point and drop pending
+        scans."""
+        self._is_stopped = True
+        self.clear()
+
+    def resume(self, folder_path):
+        """Put the interrupted scan in |folder_path| at the front of the queue.
+
+        The scan continues from the point after the last one recorded in its
+        journal.
+
+        Args:
+            folder_path (str): scan folder.
+
+        """
+        folder_path = os.path.join(folder_path, "")
+        header = journal.load(folder_path)[0]
+        definition = ScanDefinition.from_dict(header["definition"])
+        definition.resume_path = folder_path
+        self._pending.appendleft(definition)
+        return definition
+
+    def apply_values(self, values):
+        """Set attribute values. Return list of errors.
+
+        Motor positions are set by a single mv macro, so all motors move
+        together. Other values are written concurrently from this thread.
+        Failures are returned as errors, and nothing is set if the move
+        cannot be built.
+
+        Args:
+            values (list of tuple): (device, attr, value) to be set.
+
+        """
+        moves = []
+        move_macro = None
+        writes = []
+        errors = []
+        for device_name, attr, val in values:
+            print "Debug: set value for device %s." % device_name
+            device = self.get_device(device_name)
+            try:
+                move = device.get_move(attr, val)
+            except Exception as err: # pylint: disable=broad-except
+                errors.append("Failed to set attribute %s::%s: %s" %
+                              (device_name, attr, err))
+                continue
+            if move:
+                moves.append(move)
+            else:
+                writes.append((device_name, attr, device, val))
+        if moves:
+            try:
+                move_macro = self.tango.get_move_macro(moves)
+            except Exception as err: # pylint: disable=broad-except
+                errors.append("Failed to move %s: %s" %
+                              (", ".join(str(move[0]) for move in moves), err))
+        if errors:
+            # Nothing is set unless all values can be, so a scan is not left
+            # half staged.
+            return errors
+        results = asyncdevice.gather(
+                [device.set_attribute_async(attr, val)
+                 for _, attr, device, val in writes], return_exceptions=True)
+        for write, result in zip(writes, results):
+            if isinstance(result, Exception):
+                errors.append("Failed to set attribute %s::%s: %s" %
+                              (write[0], write[1], result))
+            elif not result:
+                errors.append("Failed to set attribute %s::%s." % write[:2])
+        if move_macro:
+            errors += self.tango.run_macros([("mv", move_macro)])
+        return errors
+
+    def make_folder(self):
+        """Create a new log folder. Return scan id and folder path."""
+        with self._folder_lock:
+            scan_id = datetime.datetime.now().strftime("%d%m%Y_%H%M%S")
+            base_id, idx = scan_id, 1
+            while os.path.exists(self.log_path + scan_id):
+                scan_id = "%s_%d" % (base_id, idx)
+                idx += 1
+            folder_path = self.log_path + scan_id + "/"
+            os.mkdir(folder_path)
+        return scan_id, folder_path
+
+    def run(self, on_error=_print_error, on_point=None, on_finish=None):
+        """Run pending scans in order until the queue is empty or stopped.
+
+        Args:
+            on_error (callable): called with message when a problem occurs.
+            on_point (callable): called with record of each point after it
+                    is logged. The record has keys "scan_id", "point",
+                    "value", "result", "quantities" (device name -> dict
+                    returned by |log|), "remaining" (maximum number of points
+                    left) and "eta" (estimated seconds left).
+            on_finish (callable): called with the definition of each scan
+                    taken from the queue when it is done, failed or stopped.
+                    Scans dropped from the queue by |stop| are not reported.
+
+        """
+        on_finish = on_finish or (lambda definition: None)
+        if self.is_running or not self._pending:
+            return
+        self.is_running = True
+        self._is_stopped = False
+        try:
+            stage = _Stage(self, self._pending.popleft())
+            stage.start()
+            while stage is not None and not self._is_stopped:
+                stage.join()
+                staged_next = []
+                if stage.errors:
+                    for error in stage.errors:
+                        on_error("%s: %s" % (stage.definition, error))
+                else:
+                    def on_last_point(busy_devices):
+                        """Stage the next scan while the last point is
+                        logged."""
+                        if self._pending and not self._is_stopped:
+                            staged_next.append(_Stage(
+                                    self, self._pending.popleft(),
+                                    busy_devices))
+                            staged_next[0].start()
+                    self._run_scan(stage, on_last_point, on_error, on_point)
+                on_finish(stage.definition)
+                if staged_next:
+                    stage = staged_next[0]
+                elif self._pending and not self._is_stopped:
+                    stage = _Stage(self, self._pending.popleft())
+                    stage.start()
+                else:
+                    stage = None
+            if stage is not None:
+                # Stopped while the next scan was being staged.
+                stage.join()
+                if stage.folder_path and not os.listdir(stage.folder_path):
+                    os.rmdir(stage.folder_path)
+                on_finish(stage.definition)
+        finally:
+            self.is_running = False
+
+    def open_door_log(self, folder_path, scan_id):
+        """Write the door logs of the macros run by this thread to the door
+        log of a scan. Return its writer, or None without |tango|."""
+        if not self.tango:
+            return None
+        door_file = logwriter.LogWriter(folder_path + scan_id + ".door.log",
+                                        self.flush_policy, mode="a")
+        self.tango.set_log_sink(door_file)
+        return door_file
+
+    def close_door_log(self, door_file):
+        """Stop writing door logs to |door_file| returned by
+        |open_door_log|. Return list of errors."""
+        if not door_file:
+            return []
+        self.tango.set_log_sink(None)
+        try:
+            door_file.close()
+        except IOError as err:
+            return [str(err)]
+        return []
+
+    def _run_scan(self, stage, on_last_point, on_error, on_point):
+        """Run a single staged scan."""
+        definition = stage.definition
+        self.current = definition
+        # Door logs are kept alongside the scan log.
+        door_file = self.open_door_log(stage.folder_path, stage.scan_id)
+        errors = self.apply_values(
+                [value for value in definition.static_values
+                 if value[:2] not in stage.applied])
+        if errors:
+            errors += self.close_door_log(door_file)
+            for error in errors:
+                on_error(error)
+            return
+        logging_devices = [self.get_device(name)
+                           for name in definition.logging_devices]
+        log_path = stage.folder_path + stage.scan_id + ".log"
+        header = {"scan_id": stage.scan_id,
+                  "definition": definition.to_dict()}
+        planner = definition.planner()
+        for record in stage.completed:
+            planner.tell(record["value"], record.get("result"))
+        if stage.completed:
+            # Restore device state and drop the log of the unfinished point.
+            last = stage.completed[-1]
+            for device in logging_devices:
+                device.set_state(last["state"].get(device.device_name, {}))
+            with open(log_path, "r+") as log_file:
+                log_file.truncate(last["offset"])
+            first_idx = last["point"] + 1
+            print "Debug: resume scan %s at point %d." % (stage.scan_id,
+                                                          first_idx)
+        else:
+            first_idx = 0
+        # Quantity whose result is told to |planner|.
+        monitor = definition.adaptive["monitor"] \
+                if definition.adaptive else None
+        monitor_device = self.get_device(monitor[0]) if monitor else None
+        if hasattr(monitor_device, "reductions"):
+            monitor_device.reductions.add(monitor[1])
+        scan_journal = journal.ScanJournal(stage.folder_path,
+                                           [header] + stage.completed)
+        out_file = logwriter.LogWriter(log_path, self.flush_policy,
+                                       mode="a" if first_idx else "w",
+                                       journal=scan_journal)
+        try:
+            idx = first_idx
+            started = time.time()
+            last_value = None
+            while not self._is_stopped:
+                value = planner.ask()
+                if value is None:
+                    break
+                set_started = time.time()
+                if not logging_devices[0].set_attribute(definition.attr,
+                                                        value):
+                    on_error("Failed to scan attribute %s::%s." %
+                             (definition.device, definition.attr))
+                    break
+                if last_value is not None:
+                    self.estimator.tell(definition.device,
+                                        "set " + definition.attr,
+                                        abs(value - last_value),
+                                        time.time() - set_started)
+                last_value = value
+                if planner.remaining() == 1:
+                    on_last_point(definition.logging_devices)
+                try:
+                    # Devices are logged concurrently, each writes its log
+                    # when done. Cameras start at once.
+                    results = acquisition.log(logging_devices, out_file)
+                    quantities = dict(
+                            (device.device_name, result or {})
+                            for device, result in zip(logging_devices,
+                                                      results))
+                    for device in logging_devices:
+                        for phase, size, seconds in device.timings:
+                            self.estimator.tell(device.device_name, phase,
+                                                size, seconds)
+                    result = quantities.get(monitor[0], {}).get(monitor[1]) \
+                            if monitor else None
+                    if monitor and result is None:
+                        on_error("No value of %s::%s at point %d, the point "
+                                 "is ignored by the adaptive scan." %
+                                 (monitor[0], monitor[1], idx))
+                    planner.tell(value, result)
+                    state = dict((device.device_name, device.get_state())
+                                 for device in logging_devices)
+                    out_file.end_point({"point": idx, "value": value,
+                                        "result": result, "state": state})
+                    if door_file:
+                        door_file.end_point()
+                except IOError as err:
+                    on_error(str(err))
+                    break
+                if on_point:
+                    # Remaining points at the mean time per point so far.
+                    remaining = planner.remaining()
+                    eta = remaining * (time.time() - started) / \
+                            (idx - first_idx + 1)
+                    on_point({"scan_id": stage.scan_id, "point": idx,
+                              "value": value, "result": result,
+                              "quantities": quantities,
+                              "remaining": remaining, "eta": eta})
+                idx += 1
+        finally:
+            self.current = None
+            self.estimator.save()
+            if hasattr(monitor_device, "reductions"):
+                monitor_device.reductions.discard(monitor[1])
+            for error in self.close_door_log(door_file):
+                on_error(error)
+            for device in logging_devices:
+                if hasattr(device, "close_frames"):
+                    try:
+                        device.close_frames()
+                    except IOError as err:
+                        on_error(str(err))
+            try:
+                out_file.close()
+            except IOError as err:
+                on_error(str(err))
+            scan_journal.close()
+            self.log_stats = out_file.stats
@@ -6,15 +6,24 @@ Tkinter is used for GUI.
 
 """
 
+import base64
 import os
 import time
 import Tkinter as tk
+import tkFileDialog
 import tkMessageBox
+from collections import OrderedDict
 from Tkinter import N, S, E, W
 
-import PyTango
+import numpy as np
 
 import gui
+from container import FrameReader, frame_path
+from frame import to_pgm
+from helper import is_number
+from history import decimate
+from logwriter import FlushPolicy
+from preview import FrameFetcher
 
 # TODO: Maybe a dict or a namedtuple will be a better choice?
 class Attribute(object):
@@ -41,41 +50,38 @@ class Attribute(object):
 class DeviceBase(tk.Frame):
     """Base class of device widget.
 
-    Derived classed should follow the naming convention: TypeDevice, eg.
-    CameraDevice, and define its own attributes at initialization followed by
-    a call of _create_widgets().
+    A device widget is a view of a |model.DeviceModel|. Derived classes should
+    follow the naming convention: TypeDevice, eg. CameraDevice, where Type is
+    |model.device_type|, and call _create_widgets() at initialization. Extra
+    widgets of derived classes are placed in |extra_frame|.
 
-    Device widget is created with option name and lower-case |name| as value in
-    order to retrieve the widget reference by device name from dict
-    |device_workspace_frame.children|.
+    Values typed into the widget are written back to |model.values| at once,
+    so the widget can be destroyed and rebuilt at any time by |DevicePanel|.
 
     Args:
         app: reference to main frame.
         master: reference to parent widget.
-        name (str): device name.
+        model (model.DeviceModel): device shown by the widget.
 
     Attributes:
-        device_type (str): type of device, eg. Camera.
+        model (model.DeviceModel): device shown by the widget.
         device_name (str): name of device, eg. cfeld/limaccds/poingrey.
-        tango_device: instance of tango device proxy.
-        is_always_recording (bool): whether record device info when scanning.
         common_attr (list of |Attribute|): common attributes.
         other_attr (list of |Attribute|):
                 other attributes which are displayed only in expert mode.
 
     """
-    def __init__(self, app, master, name):
-        tk.Frame.__init__(self, master, name=name.lower(), borderwidth=2,
-                          relief=tk.RAISED)
+    def __init__(self, app, master, model):
+        tk.Frame.__init__(self, master, borderwidth=2, relief=tk.RAISED)
 
         self.app = app
-        self.device_type = "DeviceBase"
-        self.device_name = name
-        self.tango_device = PyTango.DeviceProxy(name)
-        self.is_always_log = False
-        self.common_attr = []
-        self.scannable_attr = []
-        self.other_attr = []
+        self.model = model
+        self.device_name = model.device_name
+        self.common_attr = [Attribute(name, tk.Entry)
+                            for name in model.common_attr]
+        self.other_attr = [Attribute(name, tk.Entry)
+                           for name in model.other_attr]
+        self._variables = []
 
     def _create_widgets(self):
         """Create and configure all widgets."""
@@ -83,7 +89,7 @@ class DeviceBase(tk.Frame):
         self.header_frame = tk.Frame(self)
         self.device_label = tk.Label(self.header_frame, text=self.device_name,
                                      font="-weight bold")
-        self.is_expert = tk.IntVar(self, 0)
+        self.is_expert = tk.IntVar(self, int(self.model.is_expert))
         self.expert_chkbtn = tk.Checkbutton(self.header_frame,
                                             variable=self.is_expert,
                                             command=self._update_mode)
@@ -91,15 +97,10 @@ class DeviceBase(tk.Frame):
         self.common_attr_frame = tk.Frame(self)
         self.other_attr_frame = tk.Frame(self)
         for attr in self.common_attr:
-            attr.name_widget = tk.Label(self.common_attr_frame, text=attr.name)
-            attr.value_widget = \
-                    attr.widget_type(self.common_attr_frame, width=10)
-            attr.value_widget.insert(0, self.get_attribute(attr.name))
+            self._create_attr_widgets(self.common_attr_frame, attr)
         for attr in self.other_attr:
-            attr.name_widget = tk.Label(self.other_attr_frame, text=attr.name)
-            attr.value_widget = \
-                    attr.widget_type(self.other_attr_frame, width=10)
-            attr.value_widget.insert(0, self.get_attribute(attr.name))
+            self._create_attr_widgets(self.other_attr_frame, attr)
+        self.extra_frame = tk.Frame(self)
         # Footer.
         self.delete_btn = tk.Button(self, text="Delete", font="-weight bold",
                                     fg="white", bg="red", command=self._delete)
@@ -118,12 +119,15 @@ class DeviceBase(tk.Frame):
             attr.value_widget.grid(row=idx, column=1, sticky=(E, W))
         self.other_attr_frame.grid(row=2, column=0, sticky=(N, S, E, W),
                                    padx=(5, 5))
-        self.other_attr_frame.grid_remove()
+        if not self.model.is_expert:
+            self.other_attr_frame.grid_remove()
         for idx, attr in enumerate(self.other_attr):
             attr.name_widget.grid(row=idx, column=0, sticky=(W), padx=(0, 5))
             attr.value_widget.grid(row=idx, column=1, sticky=(E, W))
+        self.extra_frame.grid(row=3, column=0, sticky=(N, S, E, W),
+                              padx=(5, 5))
         # Footer.
-        self.delete_btn.grid(row=3, column=0, sticky=(E, W), padx=(5, 5))
+        self.delete_btn.grid(row=4, column=0, sticky=(E, W), padx=(5, 5))
 
         # Grid config.
         # Main.
@@ -137,278 +141,724 @@ class DeviceBase(tk.Frame):
         self.other_attr_frame.columnconfigure(0, weight=1)
         self.other_attr_frame.columnconfigure(1, weight=1)
 
-    def _delete(self):
-        """Delete widget."""
-        self.app.remove_device(self.device_name)
-        self.destroy()
-
-    def _get_attribute(self, attr):
-        """Return value of |attribute| via tango device proxy.
+    def _create_attr_widgets(self, master, attr):
+        """Create name and value widgets of |attr| bound with |model.values|.
 
         Args:
-            attr(str): attribute.
+            master: reference to parent widget.
+            attr (Attribute): attribute.
 
         """
-        return self.tango_device.read_attribute(attr).value
-
-    def _set_attribute(self, attr, val):
-        """Set value to attribute via tango device proxy.
+        def on_value_change(*args):
+            """Write the typed value back to |model.values|."""
+            self.model.values[attr.name] = variable.get()
+        attr.name_widget = tk.Label(master, text=attr.name)
+        variable = tk.StringVar(self, self.model.values.get(attr.name, ""))
+        variable.trace("w", on_value_change)
+        # Keep reference, otherwise the tk variable is unset.
+        self._variables.append(variable)
+        attr.value_widget = attr.widget_type(master, width=10,
+                                             textvariable=variable)
 
-        Args:
-            attr(str): attribute.
-            val: value.
-
-        """
-        self.tango_device.write_attribute(attr, val)
+    def _delete(self):
+        """Delete device. The widget is destroyed by |DevicePanel|."""
+        self.app.remove_device(self.device_name)
 
     def _update_mode(self):
         """Turn on/off expert mode according to |expert_chkbtn|."""
-        if self.is_expert.get() == 0:
-            self.other_attr_frame.grid_remove()
-        else:
+        self.model.is_expert = self.is_expert.get() == 1
+        if self.model.is_expert:
             self.other_attr_frame.grid()
+        else:
+            self.other_attr_frame.grid_remove()
 
-    def log(self, out):
-        """Log essential information. Called at each step of scanning if
-        |is_always_log| is True or it is the device to be scanned.
 
-        Args:
-            out (file object): where log is written.
+class LimaCCDsDevice(DeviceBase):
+    """Device widget of Camera.
 
-        """
-        out.write("%s::%s::DefaultLog\n" % (self.device_type, self.device_name))
+    Common attributes:
+        - Exposure time: tk.Entry
 
-    def get_attribute(self, attr):
-        """Get attribute value. Should take care of all attributes in
-        |common_attr|, |scannable_attr| and |other_attr|.
+    Other attributes:
+        - Number of frames: tk.Entry
 
-        Args:
-            attr(str): attribute.
+    The live preview shows the latest frame of the camera, refreshed at most
+    |PREVIEW_FPS| times per second. Frames are fetched and converted by
+    |preview.FrameFetcher| in background, from |model.frame_cache| while a
+    scan fills it.
 
-        """
-        pass
+    """
+    PREVIEW_FPS = 5.0
+    PREVIEW_WIDTH = 180
+    PREVIEW_HEIGHT = 135
 
-    def set_attribute(self, attr, val):
-        """Set attribute value. Should take care of all attributes in
-        |common_attr|, |scannable_attr| and |other_attr|. Return False if
-        failed.
+    def __init__(self, app, master, model):
+        DeviceBase.__init__(self, app, master, model)
 
-        Args:
-            attr(str): attribute.
-            val: value.
+        self._fetcher = None
+        # Pending call of |_refresh_preview|, or None.
+        self._refresh_id = None
+        self._create_widgets()
+        self.bind("<Destroy>", self._on_destroy)
+        self._update_preview_mode()
 
-        """
-        pass
+    def _create_widgets(self):
+        """Create and configure all widgets."""
+        DeviceBase._create_widgets(self)
+        self.is_preview = tk.IntVar(self, int(self.model.is_preview))
+        self.preview_chkbtn = tk.Checkbutton(
+                self.extra_frame, text="Preview", variable=self.is_preview,
+                command=self._update_preview_mode)
+        self.preview_label = tk.Label(self.extra_frame, fg="grey",
+                                      wraplength=self.PREVIEW_WIDTH)
+
+        self.preview_chkbtn.grid(row=0, column=0, sticky=(W))
+        self.preview_label.grid(row=1, column=0)
+
+    def _update_preview_mode(self):
+        """Start or stop the live preview according to |preview_chkbtn|."""
+        self.model.is_preview = self.is_preview.get() == 1
+        if self.model.is_preview and not self._fetcher:
+            self._fetcher = FrameFetcher(self.model, self.PREVIEW_WIDTH,
+                                         self.PREVIEW_HEIGHT, self.PREVIEW_FPS,
+                                         self.model.frame_cache)
+            self._fetcher.start()
+            self._refresh_preview()
+        elif not self.model.is_preview and self._fetcher:
+            self._stop_preview()
+            self.preview_label.config(image="", text="")
+            self.preview_label.image = None
+
+    def _refresh_preview(self):
+        """Show the latest fetched frame. Rescheduled while previewing."""
+        if not self._fetcher:
+            return
+        data = self._fetcher.take()
+        if data:
+            image = tk.PhotoImage(data=data)
+            self.preview_label.config(image=image, text="")
+            # Keep reference, otherwise the image is deleted.
+            self.preview_label.image = image
+        elif self._fetcher.error:
+            self.preview_label.config(image="", text=self._fetcher.error)
+        self._refresh_id = self.after(int(1000 / self.PREVIEW_FPS),
+                                      self._refresh_preview)
+
+    def _stop_preview(self):
+        """Stop fetching frames and cancel the pending refresh."""
+        if self._refresh_id:
+            self.after_cancel(self._refresh_id)
+            self._refresh_id = None
+        if self._fetcher:
+            self._fetcher.stop()
+            self._fetcher = None
+
+    def _on_destroy(self, event):
+        """Stop the live preview when the widget is destroyed, eg. scrolled
+        out of view."""
+        if event.widget is self:
+            self._stop_preview()
 
 
-class LimaCCDsDevice(DeviceBase):
-    """Device widget of Camera.
+class MotorDevice(DeviceBase):
+    """Device widget of Motor.
 
     Common attributes:
-        - Exposure time: tk.Entry
+        - Position: tk.Entry
 
     Other attributes:
-        - Number of frames: tk.Entry
+        - Step per unit: tk.Entry
+
+    """
+    def __init__(self, app, master, model):
+        DeviceBase.__init__(self, app, master, model)
+
+        self._create_widgets()
+
+
+class DevicePanel(tk.Frame):
+    """Horizontally scrollable panel of device widgets.
+
+    Devices are placed in fixed-width slots on a canvas. Only devices inside
+    the visible area have widgets. Other devices are kept as
+    |model.DeviceModel| only, so the panel scales to hundreds of devices.
+
+    Args:
+        app: reference to main frame.
+        master: reference to parent widget.
+
+    Attributes:
+        models (list of model.DeviceModel): added devices in display order.
+        is_enabled (bool): whether device widgets are enabled.
 
     """
-    def __init__(self, app, master, name):
-        DeviceBase.__init__(self, app, master, name)
+    # Width of a device slot in pixels.
+    SLOT_WIDTH = 200
+    # Number of slots built beyond each side of the visible area.
+    SLOT_MARGIN = 1
 
-        self.device_type = "LimaCCDs"
-        self.device_name = name
-        self.is_always_log = True
-        self.common_attr = [Attribute("Exposure Time", tk.Entry)]
-        self.scannable_attr = self.common_attr
-        self.other_attr = [Attribute("Number of frames", tk.Entry),
-                           Attribute("Saving next number", tk.Entry)]
+    def __init__(self, app, master):
+        tk.Frame.__init__(self, master)
 
-        # TODO: this is a workaround of the original attribute
-        # "saving_next_number" which has some weird bugs.
-        self.saving_next_number = 0
+        self.app = app
+        self.models = []
+        self.is_enabled = True
+        # Device name -> model.
+        self._models_by_name = {}
+        # Device name -> (widget, canvas item).
+        self._views = {}
+        self._is_update_pending = False
 
         self._create_widgets()
 
-    def log(self, out):
-        """Log essential information. Called at each step of scanning if
-        |is_always_log| is True or it is the device to be scanned.
+    def __len__(self):
+        return len(self.models)
 
-        Args:
-            out (file object): where log is written.
+    def _create_widgets(self):
+        """Create and configure all widgets."""
+        self.canvas = tk.Canvas(self, highlightthickness=0)
+        self.scrollbar = tk.Scrollbar(self, orient=tk.HORIZONTAL,
+                                      command=self.canvas.xview)
+        self.canvas.config(xscrollcommand=self._on_scroll)
+        self.canvas.bind("<Configure>", self._on_canvas_configure)
 
-        Log:
-            captured images stored in |app.log_path|.
-            LimaCCDs::DeviceName::Exposure Time = 1.0
-            LimaCCDs::DeviceName::ImageFile0 = CS0001.raw
+        self.canvas.grid(row=0, column=0, sticky=(N, S, E, W))
+        self.scrollbar.grid(row=1, column=0, sticky=(E, W))
 
-        """
-        nb_frames = self.tango_device.acq_nb_frames
-        # Prevent acquisition not finished error.
-        time.sleep(1.0)
-        self.tango_device.prepareAcq()
-        self.tango_device.startAcq()
-        # Wait for capturing finish.
-        while self.tango_device.last_image_ready != nb_frames - 1:
-            time.sleep(0.05)
-        self.tango_device.saving_directory = os.path.dirname(out.name)
-        self.tango_device.saving_prefix = "LIMA"
-        self.tango_device.saving_suffix = "raw"
-        self.tango_device.saving_format = "RAW"
-        self.tango_device.saving_overwrite_policy = "OVERWRITE"
-        expo = self._get_attribute("acq_expo_time")
-        content = "%s::%s::Exposure Time = %s\n" % \
-                (self.device_type, self.device_name, str(expo))
-        for image_idx in range(nb_frames):
-            image_file_name = "%s%04d%s" % (self.tango_device.saving_prefix,
-                                            self.saving_next_number,
-                                            self.tango_device.saving_suffix)
-            self.tango_device.saving_next_number = self.saving_next_number
-            self.tango_device.writeImage(image_idx)
-            self.saving_next_number += 1
-            content += "%s::%s::ImageFile%d = %s\n" % (self.device_type,
-                                                       self.device_name,
-                                                       image_idx,
-                                                       image_file_name)
-        out.write(content)
-
-    def get_attribute(self, attr):
-        """Get attribute value. Should take care of all attributes in
-        |common_attr|, |scannable_attr| and |other_attr|.
+        self.rowconfigure(0, weight=1)
+        self.columnconfigure(0, weight=1)
+
+    def _on_canvas_configure(self, event):
+        """On canvas resized. Bound with event <Configure>."""
+        for view, item in self._views.values():
+            self.canvas.itemconfig(item, height=event.height)
+        self._schedule_update()
+
+    def _on_scroll(self, first, last):
+        """On canvas scrolled. Keep |scrollbar| in sync."""
+        self.scrollbar.set(first, last)
+        self._schedule_update()
+
+    def _schedule_update(self):
+        """Update widgets once the event loop is idle."""
+        if not self._is_update_pending:
+            self._is_update_pending = True
+            self.after_idle(self._update_views)
+
+    def _update_views(self):
+        """Build widgets of visible devices and destroy the others."""
+        self._is_update_pending = False
+        left = self.canvas.canvasx(0)
+        right = left + self.canvas.winfo_width()
+        first = max(0, int(left // self.SLOT_WIDTH) - self.SLOT_MARGIN)
+        last = min(len(self.models),
+                   int(right // self.SLOT_WIDTH) + 1 + self.SLOT_MARGIN)
+        visible = self.models[first:last]
+        visible_names = set(model.device_name for model in visible)
+        for name in self._views.keys():
+            if name not in visible_names:
+                view, item = self._views.pop(name)
+                self.canvas.delete(item)
+                view.destroy()
+        for idx, model in enumerate(visible, first):
+            if model.device_name in self._views:
+                continue
+            view = globals()[model.device_type + "Device"](self.app,
+                                                           self.canvas, model)
+            if not self.is_enabled:
+                gui.Application.change_state(view, False)
+            item = self.canvas.create_window(idx * self.SLOT_WIDTH, 0,
+                                             window=view, anchor=tk.NW,
+                                             width=self.SLOT_WIDTH,
+                                             height=self.canvas.winfo_height())
+            self._views[model.device_name] = (view, item)
+
+    def _relayout(self):
+        """Move widgets to the slots of their devices after add or remove."""
+        self.canvas.config(scrollregion=(0, 0,
+                                         len(self.models) * self.SLOT_WIDTH, 0))
+        if self._views:
+            for idx, model in enumerate(self.models):
+                if model.device_name in self._views:
+                    item = self._views[model.device_name][1]
+                    self.canvas.coords(item, idx * self.SLOT_WIDTH, 0)
+        self._schedule_update()
+
+    def add(self, model):
+        """Append |model| to the panel."""
+        self.models.append(model)
+        self._models_by_name[model.device_name] = model
+        self._relayout()
+
+    def remove(self, device_name):
+        """Remove device |device_name| from the panel."""
+        model = self._models_by_name.pop(device_name)
+        self.models.remove(model)
+        if device_name in self._views:
+            view, item = self._views.pop(device_name)
+            self.canvas.delete(item)
+            view.destroy()
+        self._relayout()
+
+    def get(self, device_name):
+        """Return model of |device_name|, or None if not added."""
+        return self._models_by_name.get(device_name)
+
+    def is_visible(self, device_name):
+        """Return whether device |device_name| has a widget."""
+        return device_name in self._views
+
+    def set_state(self, state):
+        """Enable or disable all devices. Only built widgets are changed, the
+        others get |state| when they are built.
 
         Args:
-            attr(str): attribute.
+            state (bool): enable or disable the devices.
 
         """
-        if attr == "Exposure Time":
-            return self._get_attribute("acq_expo_time")
-        elif attr == "Number of frames":
-            return self._get_attribute("acq_nb_frames")
-        elif attr == "Saving next number":
-            return self.saving_next_number
-        else:
-            print "Error: unknown attribute %s." % attr
+        self.is_enabled = state
+        for view, item in self._views.values():
+            gui.Application.change_state(view, state)
+
+
+class DevicePicker(tk.Frame):
+    """Type-ahead picker of devices.
+
+    Typing into |search_entry| filters |device_listbox| through a
+    |device_index.DeviceIndex|, matching device names and aliases.
+
+    Args:
+        master: reference to parent widget.
+        index (device_index.DeviceIndex): devices to pick from.
+        command (callable): called when a device is double-clicked or Return
+                is pressed.
+
+    """
+    # Maximum number of devices listed.
+    MAX_RESULTS = 200
+
+    def __init__(self, master, index, command=None):
+        tk.Frame.__init__(self, master)
+
+        self.index = index
+        self.command = command
+        self._devices = []
+        self._is_refresh_pending = False
+
+        self._create_widgets()
+        self.refresh()
+
+    def _create_widgets(self):
+        """Create and configure all widgets."""
+        self.search_text = tk.StringVar(self, "")
+        self.search_text.trace("w", lambda *args: self._schedule_refresh())
+        self.search_entry = tk.Entry(self, textvariable=self.search_text)
+        self.search_entry.bind("<Return>", self._on_command)
+        self.search_entry.bind("<Down>", self._on_entry_down)
+        self.device_listbox = tk.Listbox(self, height=5, exportselection=0)
+        self.device_listbox.bind("<Double-Button-1>", self._on_command)
+        self.device_listbox.bind("<Return>", self._on_command)
+        self.scrollbar = tk.Scrollbar(self, orient=tk.VERTICAL,
+                                      command=self.device_listbox.yview)
+        self.device_listbox.config(yscrollcommand=self.scrollbar.set)
+
+        self.search_entry.grid(row=0, column=0, columnspan=2, sticky=(E, W))
+        self.device_listbox.grid(row=1, column=0, sticky=(N, S, E, W))
+        self.scrollbar.grid(row=1, column=1, sticky=(N, S))
+
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(1, weight=1)
+
+    def _schedule_refresh(self):
+        """Refresh once the event loop is idle, so fast typing filters once."""
+        if not self._is_refresh_pending:
+            self._is_refresh_pending = True
+            self.after_idle(self.refresh)
+
+    def _on_command(self, event):
+        """On device chosen. Bound with <Return> and <Double-Button-1>."""
+        if self.command:
+            self.command()
+
+    def _on_entry_down(self, event):
+        """Move focus to |device_listbox|. Bound with <Down>."""
+        if self._devices:
+            self.device_listbox.focus_set()
+            self.device_listbox.selection_clear(0, "end")
+            self.device_listbox.selection_set(0)
+            self.device_listbox.activate(0)
+
+    def refresh(self):
+        """Filter listed devices by |search_text|. Called after |index|
+        changes."""
+        self._is_refresh_pending = False
+        self._devices = self.index.search(self.search_text.get(),
+                                          self.MAX_RESULTS)
+        self.device_listbox.delete(0, "end")
+        for device_name in self._devices:
+            alias = self.index.get_alias(device_name)
+            self.device_listbox.insert(
+                    "end", "%s (%s)" % (device_name, alias) if alias
+                    else device_name)
+        if len(self._devices) == 1:
+            self.device_listbox.selection_set(0)
+
+    def get(self):
+        """Return selected device name, or None if none is selected."""
+        selection = self.device_listbox.curselection()
+        if not selection:
             return None
+        return self._devices[int(selection[0])]
 
-    def set_attribute(self, attr, val):
-        """Set attribute value. Should take care of all attributes in
-        |common_attr|, |scannable_attr| and |other_attr|. Return False if
-        failed.
 
-        Args:
-            attr(str): attribute.
-            val: value.
+class LogSetting(tk.Toplevel):
+    """Setting window of scan logs.
 
-        """
-        if attr == "Exposure Time":
-            min_et, max_et = self._get_attribute("valid_ranges")[:2]
-            if val < min_et or val > max_et:
-                tkMessageBox.showerror("Error",
-                        "Illegal exposure time %s." % val)
-                return False
-            self._set_attribute("acq_expo_time", val)
-        elif attr == "Number of frames":
-            self._set_attribute("acq_nb_frames", val)
-        elif attr == "Saving next number":
-            self.saving_next_number = val
+    Choose the flush policy of |scan_queue| and show backpressure metrics of
+    the last scan log.
+
+    Args:
+        master: reference to parent widget.
+        scan_queue (scan.ScanQueue): queue whose logs are configured.
+
+    """
+    def __init__(self, master, scan_queue):
+        tk.Toplevel.__init__(self, master)
+
+        self.scan_queue = scan_queue
+
+        self.title("Log")
+        self._create_widgets()
+
+    def _create_widgets(self):
+        """Create and configure all widgets."""
+        policy = self.scan_queue.flush_policy
+        # Flush policy.
+        self.policy_frame = tk.LabelFrame(self, text="Flush")
+        self.mode = tk.StringVar(self, policy.mode)
+        self.point_radiobtn = tk.Radiobutton(self.policy_frame,
+                                             text="Every point",
+                                             variable=self.mode,
+                                             value=FlushPolicy.EVERY_POINT)
+        self.points_radiobtn = tk.Radiobutton(self.policy_frame,
+                                              text="Every N points",
+                                              variable=self.mode,
+                                              value=FlushPolicy.EVERY_N_POINTS)
+        self.seconds_radiobtn = tk.Radiobutton(self.policy_frame,
+                                               text="Every T seconds",
+                                               variable=self.mode,
+                                               value=FlushPolicy.EVERY_T_SECONDS)
+        self.value_label = tk.Label(self.policy_frame, text="N / T")
+        self.value_entry = tk.Entry(self.policy_frame, width=10)
+        self.value_entry.insert(0, str(policy.value))
+        self.fsync = tk.IntVar(self, int(policy.fsync))
+        self.fsync_chkbtn = tk.Checkbutton(self.policy_frame, text="fsync",
+                                           variable=self.fsync)
+        self.apply_btn = tk.Button(self, text="Apply", command=self._apply)
+        # Metrics.
+        self.stats_frame = tk.LabelFrame(self, text="Last scan log")
+        stats = self.scan_queue.log_stats
+        if stats:
+            text = "\n".join("%s: %s" % (key, stats[key])
+                             for key in sorted(stats))
         else:
-            print "Error: unknown attribute %s." % attr
-            return False
-        return True
+            text = "No scan logged yet."
+        self.stats_label = tk.Label(self.stats_frame, text=text,
+                                    justify=tk.LEFT)
 
+        # Grid.
+        self.policy_frame.grid(row=0, column=0, sticky=(N, S, E, W),
+                               padx=10, pady=(10, 5))
+        self.point_radiobtn.grid(row=0, column=0, columnspan=2, sticky=(W))
+        self.points_radiobtn.grid(row=1, column=0, columnspan=2, sticky=(W))
+        self.seconds_radiobtn.grid(row=2, column=0, columnspan=2, sticky=(W))
+        self.value_label.grid(row=3, column=0, sticky=(W), padx=(0, 5))
+        self.value_entry.grid(row=3, column=1, sticky=(E, W))
+        self.fsync_chkbtn.grid(row=4, column=0, columnspan=2, sticky=(W))
+        self.apply_btn.grid(row=1, column=0, sticky=(E, W), padx=10)
+        self.stats_frame.grid(row=2, column=0, sticky=(N, S, E, W),
+                              padx=10, pady=(5, 10))
+        self.stats_label.grid(row=0, column=0, sticky=(W))
 
-class MotorDevice(DeviceBase):
-    """Device widget of Motor.
+        # Grid config.
+        self.columnconfigure(0, weight=1)
+        self.policy_frame.columnconfigure(1, weight=1)
+
+    def _apply(self):
+        """Apply flush policy to |scan_queue|."""
+        value = is_number(self.value_entry.get())
+        if value is None or value <= 0:
+            tkMessageBox.showerror("Error",
+                    "Illegal N / T value %s." % self.value_entry.get())
+            return
+        if self.mode.get() == FlushPolicy.EVERY_N_POINTS:
+            value = max(1, int(value))
+        self.scan_queue.flush_policy = FlushPolicy(self.mode.get(), value,
+                                                   bool(self.fsync.get()))
+        self.destroy()
 
-    Common attributes:
-        - Position: tk.Entry
 
-    Other attributes:
-        - Step per unit: tk.Entry
+class TrendPlot(tk.Toplevel):
+    """Live trend plot of an attribute in |history|.
+
+    Long time windows are decimated to the minimum and maximum of each pixel
+    column, so drawing stays fast however many samples are shown.
+
+    Args:
+        master: reference to parent widget.
+        history (history.History): recorded attribute values.
 
     """
-    def __init__(self, app, master, name):
-        DeviceBase.__init__(self, app, master, name)
+    # Time window label -> seconds.
+    WINDOWS = OrderedDict([("1 min", 60), ("10 min", 600), ("1 h", 3600),
+                           ("1 day", 86400)])
+    REFRESH_MS = 1000
+    MARGIN = 40
 
-        self.device_type = "Motor"
-        self.device_name = name
-        self.is_always_log = False
-        self.common_attr = [Attribute("Position", tk.Entry)]
-        self.scannable_attr = self.common_attr
-        self.other_attr = [Attribute("Step per unit", tk.Entry)]
+    def __init__(self, master, history):
+        tk.Toplevel.__init__(self, master)
 
+        self.history = history
+        self._keys = []
+        # Pending call of |_refresh|, or None.
+        self._refresh_id = None
+
+        self.title("Trend")
         self._create_widgets()
+        self.bind("<Destroy>", self._on_destroy)
+        self._refresh()
+
+    def _create_widgets(self):
+        """Create and configure all widgets."""
+        self.selected_attr = tk.StringVar(self, "-")
+        self.attr_menu = tk.OptionMenu(self, self.selected_attr, "-")
+        self.selected_window = tk.StringVar(self, self.WINDOWS.keys()[0])
+        self.window_menu = tk.OptionMenu(self, self.selected_window,
+                                         *self.WINDOWS.keys())
+        self.canvas = tk.Canvas(self, width=600, height=300, bg="white")
 
-    def log(self, out):
-        """Log essential information. Called at each step of scanning if
-        |is_always_log| is True or it is the device to be scanned.
+        # Grid.
+        self.attr_menu.grid(row=0, column=0, sticky=(E, W))
+        self.window_menu.grid(row=0, column=1, sticky=(E, W))
+        self.canvas.grid(row=1, column=0, columnspan=2, sticky=(N, S, E, W))
 
-        Args:
-            out (file object): where log is written.
+        # Grid config.
+        self.rowconfigure(1, weight=1)
+        self.columnconfigure(0, weight=1)
 
-        Log:
-            Motor::DeviceName::Position = 0.0
+    def _refresh(self):
+        """Update the attribute menu and redraw. Rescheduled every
+        |REFRESH_MS| milliseconds while the window is open."""
+        keys = ["%s::%s" % key for key in self.history.keys()]
+        if keys != self._keys:
+            self._keys = keys
+            gui.Application._update_menu(self.attr_menu,
+                                         self.selected_attr, keys)
+            if self.selected_attr.get() not in keys:
+                self.selected_attr.set(keys[0] if keys else "-")
+        self._draw()
+        self._refresh_id = self.after(self.REFRESH_MS, self._refresh)
+
+    def _on_destroy(self, event):
+        """Cancel the pending refresh when the window is closed."""
+        if event.widget is self and self._refresh_id:
+            self.after_cancel(self._refresh_id)
+            self._refresh_id = None
+
+    def _draw(self):
+        """Draw the selected attribute over the selected time window."""
+        self.canvas.delete("all")
+        if self.selected_attr.get() == "-":
+            return
+        device, attr = self.selected_attr.get().rsplit("::", 1)
+        width = self.canvas.winfo_width() - 2 * self.MARGIN
+        height = self.canvas.winfo_height() - 2 * self.MARGIN
+        if width < 2 or height < 2:
+            return
+        now = time.time()
+        span = self.WINDOWS[self.selected_window.get()]
+        times, values = decimate(*self.history.get(device, attr, now - span),
+                                 width=width)
+        if not len(times):
+            self.canvas.create_text(self.MARGIN, self.MARGIN, anchor=W,
+                                    text="No data.")
+            return
+        low, high = values.min(), values.max()
+        if high == low:
+            low, high = low - 0.5, high + 0.5
+        xs = self.MARGIN + (times - (now - span)) * width / span
+        ys = self.MARGIN + (high - values) * height / (high - low)
+        if len(times) > 1:
+            self.canvas.create_line(*np.column_stack((xs, ys)).ravel())
+        else:
+            self.canvas.create_oval(xs[0] - 2, ys[0] - 2, xs[0] + 2,
+                                    ys[0] + 2)
+        self.canvas.create_rectangle(self.MARGIN, self.MARGIN,
+                                     self.MARGIN + width,
+                                     self.MARGIN + height, outline="grey")
+        self.canvas.create_text(self.MARGIN, self.MARGIN - 5, anchor=tk.SW,
+                                text="%g" % high)
+        self.canvas.create_text(self.MARGIN, self.MARGIN + height + 5,
+                                anchor=tk.NW, text="%g" % low)
+        self.canvas.create_text(self.MARGIN + width, self.MARGIN + height + 5,
+                                anchor=tk.NE, text="-%s .. now" %
+                                self.selected_window.get())
+
+
+class FrameBrowser(tk.Toplevel):
+    """Browser of frames in the frame cache. Evicted frames are read from the
+    frame containers of the scans, and "Open..." browses any container.
 
-        """
-        pos = self._get_attribute("position")
-        content = "%s::%s::Position = %s\n" % \
-                (self.device_type, self.device_name, str(pos))
-        out.write(content)
+    Args:
+        master: reference to parent widget.
+        frame_cache (framecache.FrameCache): cached frames.
+        log_path (str): where scan folders are placed.
 
-    def get_attribute(self, attr):
-        """Get attribute value. Should take care of all attributes in
-        |common_attr|, |scannable_attr| and |other_attr|.
+    """
+    IMAGE_WIDTH = 512
+    IMAGE_HEIGHT = 384
 
-        Args:
-            attr(str): attribute.
+    def __init__(self, master, frame_cache, log_path):
+        tk.Toplevel.__init__(self, master)
 
-        """
-        if attr == "Position":
-            return self._get_attribute("position")
-        elif attr == "Step per unit":
-            return self._get_attribute("step_per_unit")
-        else:
-            print "Error: unknown attribute %s." % attr
-            return None
+        self.frame_cache = frame_cache
+        self.log_path = log_path
+        self._keys = []
+        # Path of the opened container, or None when browsing the cache.
+        self._container_path = None
 
-    def set_attribute(self, attr, val):
-        """Set attribute value. Should take care of all attributes in
-        |common_attr|, |scannable_attr| and |other_attr|. Return False if
-        failed.
+        self.title("Frames")
+        self._create_widgets()
+        self._refresh()
 
-        Args:
-            attr(str): attribute.
-            val: value.
+    def _create_widgets(self):
+        """Create and configure all widgets."""
+        self.frame_listbox = tk.Listbox(self, width=40, exportselection=False)
+        self.frame_listbox.bind("<<ListboxSelect>>", self._on_select)
+        self.scrollbar = tk.Scrollbar(self, command=self.frame_listbox.yview)
+        self.frame_listbox.config(yscrollcommand=self.scrollbar.set)
+        self.refresh_btn = tk.Button(self, text="Refresh",
+                                     command=self._refresh)
+        self.open_btn = tk.Button(self, text="Open...", command=self._open)
+        self.stats_label = tk.Label(self, justify=tk.LEFT)
+        self.image_label = tk.Label(self, width=self.IMAGE_WIDTH,
+                                    height=self.IMAGE_HEIGHT)
 
-        """
-        if attr == "Position":
-            # Must use device alias.
-            device_alias = self.app.tango.get_device_alias(self.device_name)
-            self.app.tango.run_macro(["mv", device_alias, str(val)])
-        elif attr == "Step per unit":
-            self._set_attribute("step_per_unit", val)
+        # Grid.
+        self.frame_listbox.grid(row=0, column=0, sticky=(N, S, E, W))
+        self.scrollbar.grid(row=0, column=1, sticky=(N, S))
+        self.image_label.grid(row=0, column=2, rowspan=4, sticky=(N, S, E, W))
+        self.refresh_btn.grid(row=1, column=0, columnspan=2, sticky=(E, W))
+        self.open_btn.grid(row=2, column=0, columnspan=2, sticky=(E, W))
+        self.stats_label.grid(row=3, column=0, columnspan=2, sticky=(W))
+
+        # Grid config.
+        self.rowconfigure(0, weight=1)
+        self.columnconfigure(2, weight=1)
+
+    def _refresh(self):
+        """List cached frames, the most recently used first."""
+        self._container_path = None
+        self._keys = list(reversed(self.frame_cache.keys()))
+        self.frame_listbox.delete(0, "end")
+        for scan_id, device, number in self._keys:
+            self.frame_listbox.insert("end", "%s  %s  #%04d" %
+                                      (scan_id, device, number))
+        stats = self.frame_cache.stats
+        self.stats_label.config(text="%d frames, %.1f / %.1f MB" % (
+                stats["frames"], stats["bytes"] / 2.0 ** 20,
+                self.frame_cache.max_bytes / 2.0 ** 20))
+
+    def _open(self):
+        """List frames of a container chosen by the user."""
+        path = tkFileDialog.askopenfilename(
+                parent=self, initialdir=self.log_path,
+                filetypes=[("Frame containers", "*.frames")])
+        if not path:
+            return
+        try:
+            reader = FrameReader(path)
+            count = len(reader)
+            reader.close()
+        except IOError as err:
+            tkMessageBox.showerror("Error", str(err), parent=self)
+            return
+        self._container_path = path
+        self._keys = range(count)
+        self.frame_listbox.delete(0, "end")
+        for number in self._keys:
+            self.frame_listbox.insert("end", "#%04d" % number)
+        self.stats_label.config(text="%d frames in %s" %
+                                (count, os.path.basename(path)))
+
+    @staticmethod
+    def _read_frame(path, number):
+        """Return frame |number| of the container at |path|, or None if it
+        cannot be read."""
+        try:
+            reader = FrameReader(path)
+        except IOError:
+            return None
+        try:
+            return reader.read(number)
+        except (IOError, IndexError):
+            return None
+        finally:
+            reader.close()
+
+    def _on_select(self, event):
+        """Show the selected frame."""
+        selection = self.frame_listbox.curselection()
+        if not selection:
+            return
+        key = self._keys[int(selection[0])]
+        if self._container_path:
+            image = self._read_frame(self._container_path, key)
         else:
-            print "Error: unknown attribute %s." % attr
-            return False
-        return True
+            image = self.frame_cache.get(key)
+            if image is None:
+                scan_id, device, number = key
+                image = self._read_frame(
+                        frame_path(self.log_path + scan_id + "/", scan_id,
+                                   device), number)
+        if image is None:
+            self.image_label.config(image="", text="Frame not found.")
+            return
+        photo = tk.PhotoImage(data=base64.b64encode(
+                to_pgm(image, self.IMAGE_WIDTH, self.IMAGE_HEIGHT)))
+        self.image_label.config(image=photo, text="")
+        # Keep reference, otherwise the image is deleted.
+        self.image_label.image = photo
 
 
 class ScanEntry(tk.Frame):
     """Scan widget for a single attribute.
 
+    The second row configures an adaptive scan, which refines the points
+    where |selected_monitor| changes fastest, within a point budget and a
+    tolerance.
+
     Args:
         master: reference to parent widget.
         device (str): device to be scanned.
         attr (str): attribute to be scanned.
+        monitors (list of str): quantities which can be monitored by adaptive
+                scans, eg. cfeld/limaccds/poingrey::Frame mean.
+        on_change (callable): called with the entry when its values may have
+                changed, eg. to update the estimated duration.
 
     Attributes:
         device (str): device to be scanned.
         attr (str): attribute to be scanned.
 
     """
-    def __init__(self, master, device, attr):
+    def __init__(self, master, device, attr, monitors=None, on_change=None):
         tk.Frame.__init__(self, master, borderwidth=2, relief=tk.RAISED)
 
         self.device = device
         self.attr = attr
+        self.monitors = monitors or ["-"]
+        self.on_change = on_change
 
         self._create_widgets()
 
@@ -435,6 +885,24 @@ class ScanEntry(tk.Frame):
         self.step_entry.insert(0, "step")
         self.step_entry.bind("<FocusIn>", self._on_entry_focusin)
         self.step_entry.bind("<FocusOut>", self._on_entry_focusout)
+        # Adaptive scan.
+        self.is_adaptive = tk.IntVar(self, 0)
+        self.adaptive_chkbtn = tk.Checkbutton(self, text="Adaptive",
+                                              variable=self.is_adaptive,
+                                              command=self._changed)
+        self.selected_monitor = tk.StringVar(self, "-")
+        self.monitor_menu = tk.OptionMenu(self, self.selected_monitor,
+                                          *self.monitors)
+        self.budget_entry = tk.Entry(self, fg="grey", width=entry_width)
+        self.budget_entry.insert(0, "budget")
+        self.budget_entry.bind("<FocusIn>", self._on_entry_focusin)
+        self.budget_entry.bind("<FocusOut>", self._on_entry_focusout)
+        self.tolerance_entry = tk.Entry(self, fg="grey", width=entry_width)
+        self.tolerance_entry.insert(0, "tolerance")
+        self.tolerance_entry.bind("<FocusIn>", self._on_entry_focusin)
+        self.tolerance_entry.bind("<FocusOut>", self._on_entry_focusout)
+        # Estimated duration.
+        self.estimate_label = tk.Label(self, fg="grey")
         # Delete.
         self.delete_btn = tk.Button(self, text="X", font="-weight bold",
                                     fg="white", bg="red", width=1,
@@ -447,6 +915,11 @@ class ScanEntry(tk.Frame):
         self.end_entry.grid(row=0, column=3)
         self.step_entry.grid(row=0, column=4)
         self.delete_btn.grid(row=0, column=5)
+        self.adaptive_chkbtn.grid(row=1, column=1, sticky=(W))
+        self.monitor_menu.grid(row=1, column=2, sticky=(E, W))
+        self.budget_entry.grid(row=1, column=3)
+        self.tolerance_entry.grid(row=1, column=4)
+        self.estimate_label.grid(row=2, column=1, columnspan=4, sticky=(W))
 
     def _on_entry_focusin(self, event):
         """On tk.entry is focused. Bound with event <FocusIn>.
@@ -454,7 +927,8 @@ class ScanEntry(tk.Frame):
         Remove hint in the entry.
 
         """
-        if event.widget.get() in ["start", "end", "step"]:
+        if event.widget.get() in ["start", "end", "step", "budget",
+                                  "tolerance"]:
             event.widget.delete(0, "end")
             event.widget.config(fg="black")
 
@@ -464,6 +938,7 @@ class ScanEntry(tk.Frame):
         Add hint to the entry if empty.
 
         """
+        self._changed()
         if event.widget.get():
             return
         event.widget.config(fg="grey")
@@ -473,6 +948,19 @@ class ScanEntry(tk.Frame):
             event.widget.insert(0, "end")
         elif event.widget == self.step_entry:
             event.widget.insert(0, "step")
+        elif event.widget == self.budget_entry:
+            event.widget.insert(0, "budget")
+        elif event.widget == self.tolerance_entry:
+            event.widget.insert(0, "tolerance")
+
+    def _changed(self):
+        """Notify |on_change| that values may have changed."""
+        if self.on_change:
+            self.on_change(self)
+
+    def set_estimate(self, text):
+        """Show estimated duration |text|."""
+        self.estimate_label.config(text=text)
 
     def update_state(self):
         """Enable or disable widgets according to |state_chkbtn|."""
@@ -488,7 +976,9 @@ if __name__ == "__main__":
     ROOT = tk.Tk()
     ATTR = Attribute("TEST_ATTR")
 
-    LIMACCD = LimaCCDsDevice(ROOT, ROOT, "TEST_CAMERA")
-    MOTOR = MotorDevice(ROOT, ROOT, "TEST_CAMERA")
+    from model import LimaCCDsModel, MotorModel
+    TANGO = gui.Tango()
+    LIMACCD = LimaCCDsDevice(ROOT, ROOT, LimaCCDsModel(TANGO, "TEST_CAMERA"))
+    MOTOR = MotorDevice(ROOT, ROOT, MotorModel(TANGO, "TEST_CAMERA"))
     ENTRY = ScanEntry(ROOT, "TEST_DEVICE", "TEST_ATTR")
     ROOT.destroy()